@@ -0,0 +1,387 @@
+import json
+import os
+import random
+import re
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import pandas as pd
+from datetime import date, datetime, timedelta
+from PIL import Image, ImageChops, ImageDraw
+from dailytradebot import Command, DailyTradeBot, LedgerEvent, apply_ledger_events, count_subreddit_posts, parse_commands, post_window
+from fake_reddit import FakeReddit
+from rendering import draw_sparkline, render_sparkline_matplotlib
+
+def synthetic_trends(n_subreddits=110, n_days=7, seed=0):
+    rng = random.Random(seed)
+    first_day = datetime(2025, 3, 1)
+    dates = [first_day + timedelta(days=i) for i in range(n_days)]
+    return [(dates, [rng.randint(0, 500) for _ in dates]) for _ in range(n_subreddits)]
+
+def benchmark_sparklines(n_subreddits=110):
+    trends = synthetic_trends(n_subreddits)
+    size = (110, 50 * n_subreddits)
+
+    started = time.perf_counter()
+    matplotlib_img = Image.new("RGB", size, "white")
+    for i, (dates, posts) in enumerate(trends):
+        matplotlib_img.paste(render_sparkline_matplotlib(dates, posts), (0, i * 50))
+    matplotlib_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    pil_img = Image.new("RGB", size, "white")
+    draw = ImageDraw.Draw(pil_img)
+    for i, (dates, posts) in enumerate(trends):
+        draw_sparkline(draw, (0, i * 50), dates, posts)
+    pil_time = time.perf_counter() - started
+
+    # Share of pixels that differ clearly between both renderers
+    difference = ImageChops.difference(matplotlib_img, pil_img).convert("L").point(lambda value: 255 if value > 64 else 0)
+    differing_pixels = difference.histogram()[255] / (size[0] * size[1])
+
+    print(f"Sparklines ({n_subreddits} subreddits)")
+    print(f"  matplotlib: {matplotlib_time:.3f} seconds")
+    print(f"  PIL:        {pil_time:.3f} seconds ({matplotlib_time / pil_time:.0f}x faster)")
+    print(f"  differing pixels: {differing_pixels:.2%}")
+
+def synthetic_ledger(n_players=100, n_days=365, seed=0):
+    # A join for every player, then every day one buy or sell, and a loan, payment or interest event for each player
+    rng = random.Random(seed)
+    subreddits = [f"subreddit{i}" for i in range(50)]
+    events = [LedgerEvent(f"player{i}", 'join', None, 1000, 0, None, 0) for i in range(n_players)]
+    holdings = {f"player{i}": {} for i in range(n_players)}
+    for _ in range(n_days):
+        for username, stocks in holdings.items():
+            if stocks and rng.random() < 0.5:
+                subreddit = rng.choice(list(stocks))
+                amount = stocks.pop(subreddit)
+                events.append(LedgerEvent(username, 'sell', subreddit, rng.randint(0, 2 * amount), -amount, 0.01, 0))
+            else:
+                subreddit = rng.choice(subreddits)
+                if subreddit not in stocks:
+                    stocks[subreddit] = rng.randint(1, 100)
+                    events.append(LedgerEvent(username, 'buy', subreddit, -stocks[subreddit], stocks[subreddit], 0.01, 0))
+            loan = rng.randint(1, 100)
+            events.append(rng.choice([
+                LedgerEvent(username, 'loan', None, loan, 0, None, loan),
+                LedgerEvent(username, 'payment', None, -loan, 0, None, -loan),
+                LedgerEvent(username, 'interest', None, -loan, 0, None, 0),
+            ]))
+    return events
+
+def benchmark_ledger_replay(n_players=100, n_days=365):
+    events = synthetic_ledger(n_players, n_days)
+
+    started = time.perf_counter()
+    state = apply_ledger_events({}, events)
+    replay_time = time.perf_counter() - started
+
+    # Round trip of a snapshot, as stored in the ledger_snapshots table
+    started = time.perf_counter()
+    json.loads(json.dumps(state))
+    snapshot_time = time.perf_counter() - started
+
+    print(f"Ledger replay ({n_players} players, {n_days} days, {len(events)} events)")
+    print(f"  replay:   {replay_time:.3f} seconds")
+    print(f"  snapshot: {snapshot_time:.3f} seconds")
+
+def legacy_extract_commands(text):
+    # The parser as it was before parse_commands, kept to compare against
+    text = text.replace("\\","")
+    commands = []
+
+    pattern = re.compile(r'\[\s*(sell|buy)\s+([\d\.,]+|all)(?:\s+r/(\w+))?\s*\]|\[\s*(loan|pay)\s+([\d\.,]+|all)\s*\]|\[\s*(exit)\s*\]|\[(.*?)\]')
+    for match in pattern.finditer(text.lower()):
+        if match.group(1):  # sell or buy
+            commands.append({'command': match.group(1), 'amount': re.sub(r"[\.,]", "", match.group(2)), 'subreddit': match.group(3), 'unrecognized': None})
+        elif match.group(4):  # loan or pay
+            commands.append({'command': match.group(4), 'amount': re.sub(r"[\.,]", "", match.group(5)), 'subreddit': None, 'unrecognized': None})
+        elif match.group(6):  # exit
+            commands.append({'command': match.group(6), 'amount': None, 'subreddit': None, 'unrecognized': None})
+        else:  # Unrecognized command
+            commands.append({'command': None, 'amount': None, 'subreddit': None, 'unrecognized': match.group(7)})
+
+    return pd.DataFrame(commands)
+
+def synthetic_comments(n_comments=5000, seed=0):
+    # Comments as players write them: some text, escaped brackets, thousands separators, links and typos
+    rng = random.Random(seed)
+    subreddits = ['memes', 'AnarchyChess', 'notinteresting', 'Damnthatsinteresting', 'chess', '196']
+    phrases = ["Let's go!", "I think this one will moon.", "Wish me luck", "Last time I lost everything, so", "ok"]
+    commands = [
+        lambda: f"[buy {rng.randint(1, 5000)} r/{rng.choice(subreddits)}]",
+        lambda: f"\\[Buy {rng.randint(1, 9)},{rng.randint(100, 999)} r/{rng.choice(subreddits)}\\]",
+        lambda: f"[sell {rng.choice(['all', str(rng.randint(1, 500))])} r/{rng.choice(subreddits)}]",
+        lambda: "[sell all]",
+        lambda: f"[loan {rng.randint(1, 3)}.000]",
+        lambda: f"[pay {rng.choice(['all', str(rng.randint(1, 300))])}]",
+        lambda: "[ exit ]",
+        lambda: f"[byu {rng.randint(1, 100)} r/{rng.choice(subreddits)}]",
+        lambda: "[my portfolio](https://www.reddit.com/r/dailygames)",
+    ]
+    return ["\n\n".join(rng.choice(phrases) + " " + rng.choice(commands)() for _ in range(rng.randint(1, 4))) for _ in range(n_comments)]
+
+def benchmark_command_parser(n_comments=5000):
+    comments = synthetic_comments(n_comments)
+
+    started = time.perf_counter()
+    legacy_results = [legacy_extract_commands(comment) for comment in comments]
+    legacy_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    results = [parse_commands(comment) for comment in comments]
+    parser_time = time.perf_counter() - started
+
+    # Both parsers have to find the same commands
+    for legacy, commands in zip(legacy_results, results):
+        legacy_commands = [Command(*(None if pd.isna(value) else value for value in row)) for row in legacy[list(Command._fields)].itertuples(index=False)]
+        assert legacy_commands == commands, (legacy_commands, commands)
+
+    print(f"Command parser ({n_comments} comments)")
+    print(f"  legacy: {legacy_time:.3f} seconds ({n_comments / legacy_time:,.0f} comments per second)")
+    print(f"  parser: {parser_time:.3f} seconds ({n_comments / parser_time:,.0f} comments per second, {legacy_time / parser_time:.0f}x faster)")
+
+class TimedCursor(sqlite3.Cursor):
+    def timed(self, function, *args):
+        started = time.perf_counter()
+        try:
+            return function(*args)
+        finally:
+            self.connection.add_time(time.perf_counter() - started)
+
+    def execute(self, *args):
+        return self.timed(super().execute, *args)
+
+    def executemany(self, *args):
+        return self.timed(super().executemany, *args)
+
+    def fetchone(self):
+        return self.timed(super().fetchone)
+
+    def fetchall(self):
+        return self.timed(super().fetchall)
+
+class TimedConnection(sqlite3.Connection):
+    # Total time spent in SQLite by all connections
+    elapsed = 0.0
+    statements = 0
+    lock = threading.Lock()
+
+    @classmethod
+    def reset(cls):
+        cls.elapsed = 0.0
+        cls.statements = 0
+
+    def add_time(self, elapsed):
+        with TimedConnection.lock:
+            TimedConnection.elapsed += elapsed
+            TimedConnection.statements += 1
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+class PhaseTimer:
+    # Exclusive time per phase: time spent in a nested phase is only counted for the nested phase
+    def __init__(self):
+        self.totals = {}
+        self.stack = []
+
+    def wrap(self, phase, function):
+        def timed(*args, **kwargs):
+            if threading.current_thread() is not threading.main_thread():
+                return function(*args, **kwargs)
+            self.stack.append(0.0)
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                nested = self.stack.pop()
+                self.totals[phase] = self.totals.get(phase, 0.0) + elapsed - nested
+                if self.stack:
+                    self.stack[-1] += elapsed
+        return timed
+
+BOT_PHASES = {
+    'backup_database': "backup",
+    'get_posts_per_subreddit': "network stand-in",
+    'get_user_posts_per_subreddit': "network stand-in",
+    'pay_interest': "command execution",
+    'execute_commands': "command execution",
+    'execute_comments_in_parallel': "command execution",
+    'prefetch_own_posts': "network stand-in",
+    'create_images': "image rendering",
+}
+
+def add_fake_game(reddit, subreddits, n_players, holdings_per_player, seed=0):
+    # Every player joins with one comment that buys holdings_per_player stocks and takes a loan, some comments start with a link.
+    # Some players comment a second time, after everyone else, to sell stocks, pay back their loan or leave the game.
+    rng = random.Random(seed)
+    comments = []
+    second_comments = []
+    for i in range(n_players):
+        username = f"player{i}"
+        holdings = rng.sample(subreddits, holdings_per_player)
+        commands = [f"[buy {rng.randint(1, 500)} r/{subreddit}]" for subreddit in holdings]
+        commands.append(f"[loan {rng.randint(1, 500)}]")
+        if i % 7 == 3:
+            # Unrecognized bracket text before the first command, like a markdown link
+            commands.insert(0, "[my portfolio](https://www.reddit.com/r/dailygames)")
+        comments.append(reddit.new_comment(username, " ".join(commands)))
+        if i % 5 == 0 and holdings:
+            second_comments.append(reddit.new_comment(username, f"[sell {rng.randint(1, 100)} r/{holdings[0]}] [pay all] [hold]"))
+        elif i % 20 == 1:
+            second_comments.append(reddit.new_comment(username, "[exit]"))
+        reddit.add_user_submission(username, rng.choice(subreddits), time.time() - rng.uniform(0, 2 * 86400))
+    return reddit.new_submission("dailygames", "DailyTrade day 1", comments + second_comments)
+
+def benchmark_run_bot(n_players, holdings_per_player=3, latency=0.0, seed=0, execution_workers=1, render=True):
+    reddit = FakeReddit(latency=latency, seed=seed)
+    # The bot writes its database, backups and images to the working directory
+    directory = tempfile.mkdtemp(prefix="dailytrade benchmark ")
+    working_directory = os.getcwd()
+    os.chdir(directory)
+    try:
+        with DailyTradeBot(reddit=reddit, connection_factory=TimedConnection) as bot:
+            bot.crawl_requests_per_minute = 1000000  # The fake backend has no rate limit
+            bot.execution_workers = execution_workers
+            if not render:
+                bot.create_images = lambda valuations=None: {}
+            bot.setup_database()
+            submission = add_fake_game(reddit, bot.allowed_subreddits(), n_players, holdings_per_player, seed)
+            bot.cursor().execute("INSERT INTO posts (post_id, date) VALUES (?, ?)", (submission.id, (date.today() - timedelta(days=1)).isoformat()))
+            bot.commit()
+
+            timer = PhaseTimer()
+            for method, phase in BOT_PHASES.items():
+                setattr(bot, method, timer.wrap(phase, getattr(bot, method)))
+            TimedConnection.reset()
+            reddit.network.requests = 0
+
+            started = time.perf_counter()
+            change_log = bot.run_bot()
+            total_time = time.perf_counter() - started
+            state = bot.state_at()
+    finally:
+        os.chdir(working_directory)
+        shutil.rmtree(directory, ignore_errors=True)
+
+    print(f"run_bot ({n_players} players, {holdings_per_player} holdings per player, {execution_workers} execution workers)")
+    print(f"  total:              {total_time:.3f} seconds")
+    for phase in sorted(set(BOT_PHASES.values())):
+        print(f"  {phase + ':':<19} {timer.totals.get(phase, 0.0):.3f} seconds")
+    print(f"  other:              {total_time - sum(timer.totals.values()):.3f} seconds")
+    print(f"  SQLite (all phases): {TimedConnection.elapsed:.3f} seconds, {TimedConnection.statements} calls")
+    print(f"  fake Reddit requests: {reddit.network.requests}")
+    return total_time, timer.totals, str(change_log), state
+
+def benchmark_parallel_execution(n_players=1000, execution_workers=4, latency=0.01):
+    # Executing the comments in parallel has to give exactly the same change log and game state
+    _, serial_totals, serial_change_log, serial_state = benchmark_run_bot(n_players, latency=latency, execution_workers=1, render=False)
+    _, parallel_totals, parallel_change_log, parallel_state = benchmark_run_bot(n_players, latency=latency, execution_workers=execution_workers, render=False)
+    assert serial_change_log == parallel_change_log
+    assert serial_state == parallel_state
+
+    print(f"Command execution ({n_players} players, {latency * 1000:.0f} ms per fake request)")
+    for name, totals in (("serial", serial_totals), (f"{execution_workers} execution workers", parallel_totals)):
+        print(f"  {name + ':':<21} {totals['command execution']:.3f} seconds executing, {totals['network stand-in']:.3f} seconds in the network stand-in")
+
+def benchmark_submission_stream(high_volume_posts_per_day=3000, latency=0.0):
+    # Counts yesterday's posts once with a crawl of the listings and once from the ingested submission stream
+    reddit = FakeReddit(posts_per_day={'memes': high_volume_posts_per_day}, latency=latency)
+    directory = tempfile.mkdtemp(prefix="dailytrade benchmark ")
+    working_directory = os.getcwd()
+    os.chdir(directory)
+    try:
+        with DailyTradeBot(reddit=reddit) as bot:
+            bot.crawl_requests_per_minute = 1000000  # The fake backend has no rate limit
+            bot.setup_database()
+            today = date.today().isoformat()
+            start_timestamp, end_timestamp = post_window(today)
+
+            reddit.network.requests = 0
+            started = time.perf_counter()
+            bot.get_posts_per_subreddit(today)
+            crawl_time = time.perf_counter() - started
+            crawl_requests = reddit.network.requests
+            crawled_memes = count_subreddit_posts(reddit, 'memes', start_timestamp, end_timestamp)
+
+            # The fake stream replays the past days at once, the first pause means the stream has caught up
+            stop = threading.Event()
+            store = bot.store_streamed_submissions
+            def store_until_caught_up(session_id, rows, caught_up):
+                store(session_id, rows, caught_up)
+                if caught_up:
+                    stop.set()
+            bot.store_streamed_submissions = store_until_caught_up
+            reddit.network.requests = 0
+            started = time.perf_counter()
+            bot.ingest_submissions(stop)
+            ingest_time = time.perf_counter() - started
+            ingest_requests = reddit.network.requests
+            # A real session would have been running since before the window started
+            bot.cursor().execute("UPDATE submission_stream SET started = ?", (start_timestamp,))
+            bot.cursor().execute("UPDATE submission_stream_subreddits SET followed_from = ?", (start_timestamp,))
+            bot.cursor().execute("DELETE FROM posts_per_subreddit")
+            bot.commit()
+
+            bot.clear_run_caches()
+            started = time.perf_counter()
+            bot.get_posts_per_subreddit(today)
+            stream_time = time.perf_counter() - started
+            streamed_memes = bot.count_streamed_posts('memes', start_timestamp, end_timestamp)
+    finally:
+        os.chdir(working_directory)
+        shutil.rmtree(directory, ignore_errors=True)
+
+    print(f"Post counts (r/memes with {high_volume_posts_per_day} posts per day)")
+    print(f"  crawl:  {crawl_time:.3f} seconds, {crawl_requests} fake requests, r/memes has {crawled_memes} posts")
+    print(f"  ingest: {ingest_time:.3f} seconds, {ingest_requests} fake requests spread over the day")
+    print(f"  stream: {stream_time:.3f} seconds, 0 fake requests, r/memes has {streamed_memes} posts")
+
+HEAVY_MODULES = ('pandas', 'matplotlib', 'PIL', 'praw')
+
+def benchmark_cli_startup(repeats=5):
+    # Time until "dailytrade.py show-table" has printed a table, in a new interpreter like a user starts it
+    directory = tempfile.mkdtemp(prefix="dailytrade benchmark ")
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "dailytrade.py")
+    try:
+        database = os.path.join(directory, "reddit_game.db")
+        with sqlite3.connect(database) as conn:
+            conn.execute("CREATE TABLE posts (post_id TEXT PRIMARY KEY, date DATE)")
+            conn.execute("INSERT INTO posts (post_id, date) VALUES ('abc', '2025-03-01')")
+
+        timings = {}
+        for name, command in (("eager imports", ["-c", f"import {', '.join(HEAVY_MODULES)}, matplotlib.pyplot"]),
+                              ("show-table", [script, "--database", database, "show-table", "posts"])):
+            elapsed = []
+            for _ in range(repeats):
+                started = time.perf_counter()
+                subprocess.run([sys.executable, *command], check=True, capture_output=True, cwd=directory)
+                elapsed.append(time.perf_counter() - started)
+            timings[name] = min(elapsed)
+
+        # Reading the database must not import the rendering and analytics dependencies
+        check = f"import sys; sys.argv = ['dailytrade.py', '--database', {database!r}, 'show-table', 'posts']; import dailytrade; dailytrade.main(); print(*[m for m in {HEAVY_MODULES!r} if m in sys.modules])"
+        loaded = subprocess.run([sys.executable, "-c", check], check=True, capture_output=True, text=True, cwd=os.path.dirname(script)).stdout.splitlines()[-1].split()
+        assert not loaded, f"show-table imported {loaded}"
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    print(f"CLI startup (best of {repeats})")
+    print(f"  importing pandas, matplotlib, PIL and praw: {timings['eager imports']:.3f} seconds")
+    print(f"  dailytrade.py show-table:                   {timings['show-table']:.3f} seconds")
+
+if __name__ == "__main__":
+    benchmark_sparklines()
+    benchmark_ledger_replay()
+    benchmark_command_parser()
+    for n_players in (10, 100, 1000):
+        benchmark_run_bot(n_players)
+    benchmark_parallel_execution()
+    benchmark_submission_stream()
+    benchmark_cli_startup()
@@ -0,0 +1,60 @@
+import argparse
+from dailytradebot import DailyTradeBot
+
+# Command line entry point, e.g. "python dailytrade.py show-table gems --order-by gems".
+# Pandas, matplotlib, PIL and praw are only imported by the subcommands that use them.
+
+def run(bot, args):
+    # After today's post the latest post is the new one, its comments are executed by tomorrow's run
+    if bot.post_is_published():
+        print("Today's post has already been published, the commands are executed by the next run.")
+        return
+    change_log = bot.run_bot()
+    if not args.no_publish:
+        bot.publish_post(change_log)
+
+def publish(bot, args):
+    # Publishes the post of a run that was checked first, like run_bot() followed by publish_post() in DailyTrade.ipynb
+    if bot.post_is_published():
+        print("Today's post has already been published, nothing is posted.")
+        return
+    bot.publish_post(bot.get_change_log(bot.get_today()))
+
+def restore(bot, args):
+    bot.restore_latest_backup()
+
+def check_sub(bot, args):
+    bot.check_sub(args.subreddit)
+
+def show_table(bot, args):
+    bot.display_table(args.table, args.order_by)
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(prog="dailytrade.py", description="Run the DailyTrade bot and inspect its database.")
+    parser.add_argument("--database", default="reddit_game.db", help="SQLite database of the game (default: %(default)s)")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subcommands.add_parser("run", help="execute the commands of the latest post and create the images")
+    run_parser.add_argument("--no-publish", action="store_true", help="do not publish the new post, so it can be checked first")
+    run_parser.set_defaults(handler=run)
+
+    subcommands.add_parser("publish", help="publish the new post with today's change log").set_defaults(handler=publish)
+    subcommands.add_parser("restore", help="restore the latest backup of the database").set_defaults(handler=restore)
+
+    check_sub_parser = subcommands.add_parser("check-sub", help="print the post counts of a subreddit of the past few days")
+    check_sub_parser.add_argument("subreddit")
+    check_sub_parser.set_defaults(handler=check_sub)
+
+    show_table_parser = subcommands.add_parser("show-table", help="print all rows of a table")
+    show_table_parser.add_argument("table")
+    show_table_parser.add_argument("--order-by", help="ORDER BY clause, e.g. \"gems DESC\"")
+    show_table_parser.set_defaults(handler=show_table)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_arguments(argv)
+    with DailyTradeBot(database=args.database) as bot:
+        args.handler(bot, args)
+
+if __name__ == "__main__":
+    main()
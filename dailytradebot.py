@@ -1,87 +1,786 @@
 from datetime import date, datetime, timedelta
-import praw
 import re
-import pandas as pd
 import sqlite3
 import shutil
-import matplotlib.pyplot as plt
-from PIL import Image, ImageDraw, ImageFont
-import io
+import importlib
 import os
-import prawcore
+import hashlib
+import itertools
+import gzip
+import json
+import csv
 import time
+import threading
+import traceback
+from contextlib import contextmanager
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+
+class LazyModule:
+    # Imports the module on first attribute access, so commands that do not need it start quickly
+    def __init__(self, name):
+        self.name = name
+        self.module = None
+
+    def __getattr__(self, attribute):
+        if self.module is None:
+            self.module = importlib.import_module(self.name)
+        return getattr(self.module, attribute)
+
+pd = LazyModule('pandas')
+praw = LazyModule('praw')
+prawcore = LazyModule('prawcore')
+rendering = LazyModule('rendering')
+
+def post_window(date):
+    # Posts are counted from 5 AM on the previous day up to 5 AM on the given date
+    end_date = datetime.strptime(date, "%Y-%m-%d")
+    end_datetime = datetime(end_date.year, end_date.month, end_date.day, 5, 0)
+    start_datetime = end_datetime - timedelta(hours=24)
+    return int(start_datetime.timestamp()), int(end_datetime.timestamp())
+
+def retry_on_server_error(function, *args):
+    nTries = 0
+    while nTries < 20:
+        try:
+            return function(*args)
+        except prawcore.exceptions.ServerError:
+            print('Server error occurred, trying again in 10 seconds')
+            time.sleep(10)
+            nTries += 1
+    raise Exception('20 server errors occured!')
+
+class RateLimiter:
+    def __init__(self, requests_per_minute=None):
+        # Without a budget, requests are only counted
+        self.interval = 0 if requests_per_minute is None else 60 / requests_per_minute
+        self.lock = threading.Lock()
+        self.next_slot = time.monotonic()
+        self.requests = 0
+
+    def wait(self):
+        with self.lock:
+            self.requests += 1
+            now = time.monotonic()
+            wait_time = self.next_slot - now
+            self.next_slot = max(now, self.next_slot) + self.interval
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+def count_subreddit_posts(reddit, subreddit, start_timestamp, end_timestamp, rate_limiter=None):
+    post_count = 0
+    # Listings are fetched in pages of 100 submissions, each page is one request.
+    # The listing only requests a page when its first submission is needed, so the slot is taken before asking for that submission.
+    limit = 1000
+    listing = iter(reddit.subreddit(subreddit).new(limit=limit))
+    for i in itertools.count():
+        if rate_limiter is not None and i % 100 == 0 and i < limit:
+            rate_limiter.wait()
+        submission = next(listing, None)
+        if submission is None:
+            break
+        if start_timestamp <= submission.created_utc < end_timestamp:
+            post_count += 1
+        if submission.created_utc < start_timestamp:  # Stop early if past range
+            break
+    return post_count
+
+def crawl_subreddit(reddit, subreddit, start_timestamp, end_timestamp, rate_limiter=None):
+    started = time.perf_counter()
+    post_count = retry_on_server_error(count_subreddit_posts, reddit, subreddit, start_timestamp, end_timestamp, rate_limiter)
+    return post_count, time.perf_counter() - started
+
+RenderJob = namedtuple('RenderJob', ['render_function', 'filename', 'data', 'params'])
+
+def timed_render(job):
+    started = time.perf_counter()
+    job.render_function(job.data, job.filename, **job.params)
+    return time.perf_counter() - started
+
+# Increase when the output of the render functions changes, so that old cached images are not reused
+RENDER_CACHE_VERSION = 1
+
+class RenderCache:
+    def __init__(self, directory="render cache", max_bytes=100 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def key(self, name, data, params):
+        digest = hashlib.sha256(f"{RENDER_CACHE_VERSION} {name} {sorted(params.items())!r}".encode())
+        if isinstance(data, pd.DataFrame):
+            digest.update(repr(list(data.columns)).encode())
+            digest.update(data.to_csv(index=False).encode())
+        else:
+            digest.update(repr(data).encode())
+        return digest.hexdigest()
 
-def wrap_method(method):
-    def wrapped(self, *args, **kwargs): 
-        previously_keep_open = self._keep_open
-        self._keep_open = kwargs.pop('keep_open', previously_keep_open) or previously_keep_open
+    def path(self, key):
+        return os.path.join(self.directory, f"{key}.png")
+
+    def fetch(self, key, filename):
+        path = self.path(key)
+        if not os.path.exists(path):
+            return False
+        shutil.copyfile(path, filename)
+        os.utime(path)  # Mark as recently used
+        return True
+
+    def store(self, key, filename):
+        os.makedirs(self.directory, exist_ok=True)
+        shutil.copyfile(filename, self.path(key))
+        self.evict()
+
+    def evict(self):
+        # Remove the least recently used images until the cache fits in max_bytes
+        files = [os.path.join(self.directory, f) for f in os.listdir(self.directory) if f.endswith('.png')]
+        files.sort(key=os.path.getmtime)
+        total_size = sum(os.path.getsize(f) for f in files)
+        while files and total_size > self.max_bytes:
+            oldest = files.pop(0)
+            total_size -= os.path.getsize(oldest)
+            os.remove(oldest)
+
+# Backups from before the backup store, e.g. "reddit_game 2025-03-01 05.10.00 for restoration.db"
+LEGACY_BACKUP_PATTERN = re.compile(r"^reddit_game (\d{4}-\d{2}-\d{2} \d{2}\.\d{2}\.\d{2})( for restoration)?\.db$")
+
+class BackupStore:
+    def __init__(self, directory="backups", legacy_directory="."):
+        self.directory = directory
+        self.legacy_directory = legacy_directory
+
+    def create(self, conn, for_restoration=False):
+        os.makedirs(self.directory, exist_ok=True)
+        timestamp = datetime.now()
+        name = f"reddit_game {timestamp.strftime('%Y-%m-%d %H.%M.%S')}{' for restoration' if for_restoration else ''}"
+        path = os.path.join(self.directory, f"{name}.db.gz")
+
+        # The backup API gives a consistent copy while the database is open, also with changes still in the write-ahead log
+        temporary_path = os.path.join(self.directory, f"{name}.tmp")
+        destination = sqlite3.connect(temporary_path)
+        try:
+            conn.backup(destination)
+        finally:
+            destination.close()
+        with open(temporary_path, 'rb') as source, gzip.open(path, 'wb') as target:
+            shutil.copyfileobj(source, target)
+        size = os.path.getsize(temporary_path)
+        os.remove(temporary_path)
+
+        metadata = {
+            'file': os.path.basename(path),
+            'timestamp': timestamp.isoformat(),
+            'for_restoration': for_restoration,
+            'schema_version': conn.execute("PRAGMA user_version").fetchone()[0],
+            'size': size,
+            'compressed_size': os.path.getsize(path),
+        }
+        with open(os.path.join(self.directory, f"{name}.json"), 'w') as f:
+            json.dump(metadata, f, indent=2)
+        return metadata
+
+    def backups(self):
+        backups = []
+        if os.path.isdir(self.directory):
+            for filename in os.listdir(self.directory):
+                if not filename.endswith('.json'):
+                    continue
+                with open(os.path.join(self.directory, filename)) as f:
+                    metadata = json.load(f)
+                metadata['path'] = os.path.join(self.directory, metadata['file'])
+                metadata['metadata_path'] = os.path.join(self.directory, filename)
+                backups.append(metadata)
+        for filename in os.listdir(self.legacy_directory):
+            match = LEGACY_BACKUP_PATTERN.match(filename)
+            if match:
+                backups.append({
+                    'file': filename,
+                    'path': os.path.join(self.legacy_directory, filename),
+                    'timestamp': datetime.strptime(match.group(1), '%Y-%m-%d %H.%M.%S').isoformat(),
+                    'for_restoration': match.group(2) is not None,
+                })
+        return sorted(backups, key=lambda backup: backup['timestamp'])
+
+    def latest(self):
+        # Backups made right before a restoration contain the state that was rejected, so they are skipped
+        backups = [backup for backup in self.backups() if not backup['for_restoration']]
+        return backups[-1] if backups else None
+
+    def restore(self, backup, conn):
+        source_path = backup['path']
+        if source_path.endswith('.gz'):
+            source_path = os.path.join(self.directory, "restore.tmp")
+            with gzip.open(backup['path'], 'rb') as source, open(source_path, 'wb') as target:
+                shutil.copyfileobj(source, target)
+        source = sqlite3.connect(source_path)
+        try:
+            # Copying into the open connection replaces the database pages without touching the files behind SQLite's back
+            source.backup(conn)
+        finally:
+            source.close()
+            if source_path != backup['path']:
+                os.remove(source_path)
+
+    def prune(self, keep_daily, keep_weekly):
+        # Keep the oldest backup of the last keep_daily days and of the last keep_weekly weeks that have a backup, which is the state before the first run of that day.
+        # All backups of today are kept, so a run that is resumed or retried never removes the backup from before today's first run.
+        # Backups made before a restoration are counted separately, so they never push out the backup that was restored.
+        backups = [backup for backup in self.backups() if 'metadata_path' in backup]
+        today = date.today()
+        keep = {backup['file'] for backup in backups if datetime.fromisoformat(backup['timestamp']).date() == today}
+        for for_restoration in (False, True):
+            group = [backup for backup in backups if backup['for_restoration'] == for_restoration]
+            for period, count in ((lambda day: day.isoformat(), keep_daily), (lambda day: day.isocalendar()[:2], keep_weekly)):
+                oldest = {}
+                for backup in group:
+                    oldest.setdefault(period(datetime.fromisoformat(backup['timestamp']).date()), backup['file'])
+                keep.update(oldest[key] for key in sorted(oldest)[-count:] if count > 0)
+        for backup in backups:
+            if backup['file'] not in keep:
+                os.remove(backup['path'])
+                os.remove(backup['metadata_path'])
+                print(f"Removed old backup {backup['file']}")
+
+# The allowed subreddits when the allowed_subreddits table was introduced. Moderators can change the list with [allow r/...] and [disallow r/...].
+DEFAULT_ALLOWED_SUBREDDITS = ['dailygames','notinteresting', 'learnpython', 'mildlyinfuriating', '196', '3Blue1Brown', 'AmIOverreacting', 'AmITheAsshole', 'Angryupvote', 'Animal', 'animation', 'antimeme', 'anythingbutmetric', 'AskOuija', 'assholedesign', 'BeAmazed', 'birdification', 'birthofasub', 'blursedimages', 'brandnewsentence', 'capybara', 'chemistrymemes', 'clevercomebacks', 'confidentlyincorrect', 'copypasta', 'countablepixels', 'Damnthatsinteresting', 'dataisbeautiful', 'DnD', 'dndmemes', 'ExplainTheJoke', 'facepalm', 'Fantasy', 'foundsatan', 'foundthemobileuser', 'FreeCompliments', 'gameofthrones', 'geocaching', 'girlsarentreal', 'GuysBeingDudes', 'iamverysmart', 'ididnthaveeggs', 'ihadastroke', 'im14andthisisdeep', 'interesting', 'interestingasfuck', 'LeftTheBurnerOn', 'LetGirlsHaveFun', 'lfg', 'lgbt', 'lies', 'linguisticshumor', 'LinkedInLunatics', 'lostredditors', 'MadeMeSmile', 'mapporncirclejerk', 'MathJokes', 'mathmemes', 'meirl', 'meme', 'memes', 'mildlyinteresting', 'MurderedByWords', 'nature', 'Nicegirls', 'NoahGetTheBoat', 'NonPoliticalTwitter', 'oddlyspecific', 'offmychest', 'onejob', 'penpals', 'PeterExplainsTheJoke', 'pettyrevenge', 'physicsmemes', 'politics', 'PrematureTruncation', 'rareinsults', 'rpg', 'screenshotsarehard', 'softwaregore', 'sssdfg', 'SUBREDDITNAME', 'technicallythetruth', 'teenagersbutbetter', 'thatHappened', 'theydidthemath', 'Tinder', 'trolleyproblem', 'TwoSentenceHorror', 'vexillologycirclejerk', 'circlejerk', 'WeirdEggs', 'Whatcouldgowrong', 'whatisthisthing', 'woosh', 'wordle', 'AnarchyChess', 'shittydarksouls', 'KitchenConfidential', 'CountOnceADay', 'countwithchickenlady', 'SquaredCircle', 'chess', 'Warhammer40k', 'PrimarchGFs', 'SpeedOfLobsters']
+
+SEED_ALLOWED_SUBREDDITS = "INSERT OR IGNORE INTO allowed_subreddits (subreddit) VALUES " + ", ".join(f"('{subreddit}')" for subreddit in DEFAULT_ALLOWED_SUBREDDITS)
+
+def rebuild_table(table, columns, column_names, select=None):
+    # SQLite cannot change column types in place, so the table is copied into a new table with the new definition
+    return [
+        f"CREATE TABLE {table}_new ({columns})",
+        f"INSERT OR IGNORE INTO {table}_new ({column_names}) SELECT {select or column_names} FROM {table} ORDER BY rowid",
+        f"DROP TABLE {table}",
+        f"ALTER TABLE {table}_new RENAME TO {table}",
+    ]
+
+# Every migration upgrades the database by one version. The version of a database is stored in PRAGMA user_version.
+# Never change a migration that has been released, add a new one instead.
+MIGRATIONS = [
+    # 1: case-insensitive subreddit names, so lookups can use the primary key index instead of LOWER()
+    rebuild_table('posts_per_subreddit',
+                  'subreddit TEXT COLLATE NOCASE, date DATE, posts INT, PRIMARY KEY (subreddit, date)',
+                  'subreddit, date, posts')
+    + rebuild_table('user_posts_per_subreddit',
+                    'username TEXT, subreddit TEXT COLLATE NOCASE, date DATE, posts INT, PRIMARY KEY (username, subreddit, date)',
+                    'username, subreddit, date, posts'),
+    # 2: gems and amounts are stored as integers instead of text
+    rebuild_table('gems',
+                  'username TEXT, gems INTEGER, date DATE, PRIMARY KEY (username, date)',
+                  'username, gems, date', 'username, CAST(gems AS INTEGER), date')
+    + rebuild_table('stocks',
+                    'username TEXT, subreddit TEXT, amount INTEGER, value FLOAT, PRIMARY KEY (username, subreddit)',
+                    'username, subreddit, amount, value', 'username, subreddit, CAST(amount AS INTEGER), value')
+    + rebuild_table('trades',
+                    'username TEXT, subreddit TEXT, amount INTEGER, value FLOAT, date DATE, type TEXT, PRIMARY KEY (username, subreddit, date, type)',
+                    'username, subreddit, amount, value, date, type', 'username, subreddit, CAST(amount AS INTEGER), value, date, type')
+    + rebuild_table('loans',
+                    'username TEXT PRIMARY KEY, amount INTEGER',
+                    'username, amount', 'username, CAST(amount AS INTEGER)')
+    + rebuild_table('loans_backup',
+                    'username TEXT, amount INTEGER, type TEXT, date DATE, PRIMARY KEY (username, date, type)',
+                    'username, amount, type, date', 'username, CAST(amount AS INTEGER), type, date'),
+    # 3: current gems are kept in balances, gems keeps one row per change
+    rebuild_table('gems',
+                  'username TEXT, gems INTEGER, date DATE',
+                  'username, gems, date')
+    + [
+        "CREATE INDEX IF NOT EXISTS gems_username ON gems (username, date)",
+        "CREATE TABLE IF NOT EXISTS balances (username TEXT PRIMARY KEY, gems INTEGER, updated DATE)",
+        """INSERT OR REPLACE INTO balances (username, gems, updated)
+           SELECT g.username, g.gems, g.date FROM gems g
+           WHERE g.date = (SELECT MAX(date) FROM gems WHERE username = g.username)""",
+    ],
+    # 4: the allowed subreddits are stored in the database instead of in the code
+    [
+        "CREATE TABLE IF NOT EXISTS allowed_subreddits (subreddit TEXT COLLATE NOCASE PRIMARY KEY, added DATE, added_by TEXT)",
+        SEED_ALLOWED_SUBREDDITS,
+    ],
+    # 5: submissions of the allowed subreddits are followed with a stream, so post counts do not need a crawl
+    [
+        "CREATE TABLE IF NOT EXISTS submissions (submission_id TEXT PRIMARY KEY, subreddit TEXT COLLATE NOCASE, author TEXT COLLATE NOCASE, created_utc FLOAT)",
+        "CREATE INDEX IF NOT EXISTS submissions_subreddit ON submissions (subreddit, created_utc)",
+        "CREATE TABLE IF NOT EXISTS submission_stream (id INTEGER PRIMARY KEY AUTOINCREMENT, started INTEGER, last_seen INTEGER)",
+    ],
+    # 6: coverage of the submission stream is recorded per subreddit, because subreddits join and leave the stream during a session
+    [
+        "CREATE TABLE IF NOT EXISTS submission_stream_subreddits (stream_id INTEGER, subreddit TEXT COLLATE NOCASE, followed_from INTEGER, followed_until INTEGER)",
+        "CREATE INDEX IF NOT EXISTS submission_stream_subreddits_stream ON submission_stream_subreddits (stream_id)",
+    ],
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+class ConnectionManager:
+    def __init__(self, database="reddit_game.db", cache_size=-16000, factory=sqlite3.Connection, trace_callback=None):
+        self.database = database
+        self.factory = factory
+        self.trace_callback = trace_callback  # Called with every SQL statement that is executed
+        self.cache_size = cache_size  # Negative values are in KiB
+        self.open_count = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = {}  # Thread that opened the connection: connection
+        self._savepoint_counter = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close_all()
+
+    def is_open(self):
+        return getattr(self._local, 'connection', None) is not None
+
+    def connection(self):
+        # Every thread gets its own long-lived connection
+        if not self.is_open():
+            conn = sqlite3.connect(self.database, check_same_thread=False, factory=self.factory)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            conn.execute(f"PRAGMA cache_size = {self.cache_size}")
+            conn.execute("PRAGMA temp_store = MEMORY")
+            if self.trace_callback is not None:
+                conn.set_trace_callback(self.trace_callback)
+            self._local.connection = conn
+            self._local.cursor = conn.cursor()
+            self._local.transaction_depth = 0
+            with self._lock:
+                self._connections[threading.current_thread()] = conn
+                self.open_count += 1
+        return self._local.connection
+
+    def cursor(self):
+        self.connection()
+        return self._local.cursor
+
+    def close_finished_threads(self):
+        # Worker threads do not close their connections, they are closed once the threads have finished, e.g. after a ThreadPoolExecutor
+        with self._lock:
+            finished = [thread for thread in self._connections if not thread.is_alive()]
+            connections = [self._connections.pop(thread) for thread in finished]
+        for conn in connections:
+            conn.close()
+
+    def close_all(self):
+        with self._lock:
+            connections = list(self._connections.values())
+            self._connections = {}
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+
+    def transaction_depth(self):
+        return getattr(self._local, 'transaction_depth', 0)
+
+    def commit(self):
+        # Inside a unit of work, changes are committed once at the end of the unit of work
+        if self.transaction_depth() == 0:
+            self.connection().commit()
+
+    @contextmanager
+    def unit_of_work(self):
+        if self.transaction_depth() > 0:
+            with self.savepoint():
+                yield
+            return
+
+        conn = self.connection()
+        if conn.in_transaction:
+            conn.commit()
+        conn.execute("BEGIN")
+        self._local.transaction_depth = 1
+        try:
+            yield
+        except BaseException:
+            self._local.transaction_depth = 0
+            conn.rollback()
+            raise
+        self._local.transaction_depth = 0
+        conn.commit()
+
+    @contextmanager
+    def bind(self, conn):
+        # Lets the current thread use conn, e.g. an in-memory copy of the database, instead of its own connection
+        previous = (getattr(self._local, 'connection', None), getattr(self._local, 'cursor', None), self.transaction_depth())
+        self._local.connection = conn
+        self._local.cursor = conn.cursor()
+        self._local.transaction_depth = 0
+        try:
+            yield conn
+        finally:
+            self._local.connection, self._local.cursor, self._local.transaction_depth = previous
+
+    @contextmanager
+    def savepoint(self):
+        if self.transaction_depth() == 0:
+            with self.unit_of_work():
+                yield
+            return
+
+        with self._lock:
+            self._savepoint_counter += 1
+            name = f"savepoint_{self._savepoint_counter}"
+        conn = self.connection()
+        conn.execute(f"SAVEPOINT {name}")
+        self._local.transaction_depth += 1
+        try:
+            yield
+        except BaseException:
+            conn.execute(f"ROLLBACK TO {name}")
+            conn.execute(f"RELEASE {name}")
+            raise
+        finally:
+            self._local.transaction_depth -= 1
+        conn.execute(f"RELEASE {name}")
 
-        self._call_stack.append(method.__name__)
+class ChangeLogEntry:
+    __slots__ = ('username', 'message')
 
-        result = method(self, *args, **kwargs)
+    def __init__(self, username, message):
+        self.username = username
+        self.message = message
+
+class ChangeLog:
+    separator = '\n\n---\n'
+
+    def __init__(self):
+        self.entries = []
 
-        self._call_stack.pop()
-        if not self._call_stack:
-            self.handle_connection(self._keep_open)
+    def __len__(self):
+        return len(self.entries)
 
-        if not previously_keep_open:
-            self._keep_open = False
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __str__(self):
+        return self.separator.join(self.blocks())
+
+    def add(self, username, message):
+        self.entries.append(ChangeLogEntry(username, message))
+
+    def blocks(self):
+        # One block of text per user, in alphabetical order, with the messages of that user in the order they were added
+        messages = {}
+        for entry in self.entries:
+            messages.setdefault(entry.username, []).append(entry.message)
+        for username in sorted(messages):
+            yield f"u/{username}\n\n" + '\n\n'.join(messages[username])
+
+    def chunks(self, max_length):
+        chunk = ''
+        for block in self.blocks():
+            if chunk and len(chunk) + len(self.separator) + len(block) <= max_length:
+                chunk += self.separator + block
+                continue
+            if chunk:
+                yield chunk
+            while len(block) > max_length:
+                split_index = block.rfind('\n', 0, max_length)
+                if split_index <= 0:  # If no newline is found, force split
+                    split_index = max_length
+                yield block[:split_index]
+                block = block[split_index:].lstrip('\n')
+            chunk = block
+        if chunk:
+            yield chunk
+
+Command = namedtuple('Command', ['command', 'amount', 'subreddit', 'unrecognized'])
+
+COMMAND_PATTERN = re.compile(r'\[\s*(sell|buy)\s+([\d\.,]+|all)(?:\s+r/(\w+))?\s*\]|\[\s*(loan|pay)\s+([\d\.,]+|all)\s*\]|\[\s*(exit)\s*\]|\[\s*(allow|disallow)\s+r/(\w+)\s*\]|\[(.*?)\]', re.IGNORECASE)
+# Thousands separators are allowed in amounts, e.g. 1.000 or 1,000
+AMOUNT_SEPARATORS = str.maketrans('', '', '.,')
+
+def parse_commands(text):
+    # Backslashes are removed first, because reddit escapes brackets in some editors
+    commands = []
+    for sell_or_buy, trade_amount, subreddit, loan_or_pay, loan_amount, exit_command, admin_command, admin_subreddit, unrecognized in COMMAND_PATTERN.findall(text.replace("\\", "")):
+        if sell_or_buy:
+            commands.append(Command(sell_or_buy.lower(), trade_amount.lower().translate(AMOUNT_SEPARATORS), subreddit.lower() or None, None))
+        elif loan_or_pay:
+            commands.append(Command(loan_or_pay.lower(), loan_amount.lower().translate(AMOUNT_SEPARATORS), None, None))
+        elif exit_command:
+            commands.append(Command('exit', None, None, None))
+        elif admin_command:
+            commands.append(Command(admin_command.lower(), None, admin_subreddit, None))
+        else:
+            commands.append(Command(None, None, None, unrecognized.lower()))
+    return commands
+
+# Executes one command for a player, the post date is the date of the post the command was given under
+COMMAND_HANDLERS = {
+    'buy': lambda bot, username, command, post_date: bot.buy(username, command.amount, command.subreddit, post_date),
+    'sell': lambda bot, username, command, post_date: bot.sell(username, command.amount, command.subreddit, post_date),
+    'loan': lambda bot, username, command, post_date: bot.loan(username, command.amount, bot.get_today()),
+    'pay': lambda bot, username, command, post_date: bot.pay(username, command.amount, bot.get_today()),
+    'exit': lambda bot, username, command, post_date: bot.exit_game(username),
+    'allow': lambda bot, username, command, post_date: bot.allow_subreddit(username, command.subreddit),
+    'disallow': lambda bot, username, command, post_date: bot.disallow_subreddit(username, command.subreddit),
+    None: lambda bot, username, command, post_date: bot.unknown_command(username, command.unrecognized),
+}
+
+LedgerEvent = namedtuple('LedgerEvent', ['username', 'event', 'subreddit', 'gems', 'amount', 'value', 'loan'])
+
+def new_player_state():
+    return {'gems': 0, 'stocks': {}, 'loan': 0}
+
+def apply_ledger_events(state, events):
+    # State maps every username to their gems, stocks ({subreddit: [amount, value]}) and loan
+    for username, event, subreddit, gems, amount, value, loan in events:
+        if event == 'exit':
+            state.pop(username, None)
+            continue
+        player = state.get(username)
+        if player is None:
+            player = state[username] = new_player_state()
+        player['gems'] += gems
+        player['loan'] += loan
+        if subreddit is not None:
+            stocks = player['stocks']
+            if event == 'buy':
+                stocks[subreddit] = [amount, value]
+            else:
+                stock = stocks[subreddit]
+                stock[0] += amount
+                if stock[0] <= 0:
+                    del stocks[subreddit]
+    return state
+
+class Profiler:
+    # Collects timings and counters of a run. Statements and commits are attributed to the innermost bot method that is running in the same thread.
+    def __init__(self, directory="profiles"):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started = datetime.now()
+            self.methods = {}
+            self.counters = {}
+            self.timings = {}
+            self.phases = {}
+
+    def stack(self):
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+        return self.local.stack
+
+    def method_stats(self, name):
+        if name not in self.methods:
+            self.methods[name] = {'calls': 0, 'seconds': 0.0, 'sql_statements': 0, 'commits': 0}
+        return self.methods[name]
+
+    def call(self, name, function, *args, **kwargs):
+        stack = self.stack()
+        stack.append(name)
+        started = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            stack.pop()
+            # Time of recursive calls is only counted once
+            with self.lock:
+                stats = self.method_stats(name)
+                stats['calls'] += 1
+                if name not in stack:
+                    stats['seconds'] += elapsed
+
+    def sql_statement(self, statement):
+        stack = self.stack()
+        with self.lock:
+            stats = self.method_stats(stack[-1] if stack else '(outside bot methods)')
+            stats['sql_statements'] += 1
+            if statement.lstrip()[:6].upper() == 'COMMIT':
+                stats['commits'] += 1
+
+    def count(self, name, key, amount=1):
+        with self.lock:
+            counters = self.counters.setdefault(name, {})
+            counters[key] = counters.get(key, 0) + amount
+
+    def time(self, name, key, seconds):
+        with self.lock:
+            timing = self.timings.setdefault(name, {}).setdefault(key, {'count': 0, 'seconds': 0.0})
+            timing['count'] += 1
+            timing['seconds'] += seconds
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - started
+
+    def report(self):
+        with self.lock:
+            return {
+                'started': self.started.isoformat(),
+                'seconds': sum(self.phases.values()),
+                'phases': dict(self.phases),
+                'methods': {name: dict(stats) for name, stats in sorted(self.methods.items())},
+                'counters': {name: dict(counters) for name, counters in self.counters.items()},
+                'timings': {name: {key: dict(timing) for key, timing in timings.items()} for name, timings in self.timings.items()},
+            }
+
+    def summary(self):
+        report = self.report()
+        lines = [f"Run took {report['seconds']:.2f} seconds"]
+        lines += [f"  {phase}: {seconds:.2f} seconds" for phase, seconds in report['phases'].items()]
+        total_statements = sum(stats['sql_statements'] for stats in report['methods'].values())
+        total_commits = sum(stats['commits'] for stats in report['methods'].values())
+        lines.append(f"  {total_statements} SQL statements, {total_commits} commits")
+        lines += [f"  {key}: {amount} API calls" for key, amount in report['counters'].get('api_calls', {}).items()]
+        return "\n".join(lines)
+
+    def write(self):
+        # One JSON file with all details per run, and one line per run in a CSV file to compare runs over days
+        report = self.report()
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"profile {self.started.strftime('%Y-%m-%d %H.%M.%S')}.json")
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+
+        phases = ['setup', 'crawl', 'load comments', 'commands', 'images']
+        csv_path = os.path.join(self.directory, "runs.csv")
+        new_file = not os.path.exists(csv_path)
+        with open(csv_path, 'a', newline='') as f:
+            writer = csv.writer(f)
+            if new_file:
+                writer.writerow(['started', 'seconds'] + phases + ['sql_statements', 'commits', 'api_calls'])
+            writer.writerow([report['started'], round(report['seconds'], 3)]
+                            + [round(report['phases'].get(phase, 0.0), 3) for phase in phases]
+                            + [sum(stats['sql_statements'] for stats in report['methods'].values()),
+                               sum(stats['commits'] for stats in report['methods'].values()),
+                               sum(report['counters'].get('api_calls', {}).values())])
+        return path
+
+# Methods that are not wrapped, because they are called very often or do not touch the database
+UNWRAPPED_METHODS = {'connection_is_open', 'open_connection', 'close_connection', 'conn', 'cursor', 'commit', 'unit_of_work', 'savepoint',
+                     'isfloat', 'get_today', 'to_unix_timestamp', 'allowed_subreddits', 'is_allowed_subreddit', 'stream_covers', 'thread_reddit',
+                     'unknown_command', 'split_change_log'}
 
-        return result
+def wrap_method(method):
+    name = method.__name__
+    def wrapped(self, *args, **kwargs):
+        # Connections stay open until close_connection() is called, keep_open is only accepted for backwards compatibility
+        kwargs.pop('keep_open', None)
+        profiler = getattr(self, 'profiler', None)
+        if profiler is None:
+            return method(self, *args, **kwargs)
+        return profiler.call(name, method, self, *args, **kwargs)
+    wrapped.__name__ = name
     return wrapped
 
 class AutoPostCallMeta(type):
     def __new__(cls, name, bases, class_dict):
         new_dict = {}
         for attr_name, attr_value in class_dict.items():
-            if callable(attr_value) and not attr_name.startswith("__") and attr_name not in ['handle_connection', 'connection_is_open', 'open_connection', 'close_connection', 'conn', 'cursor']:
+            if callable(attr_value) and not attr_name.startswith("__") and attr_name not in UNWRAPPED_METHODS:
                 attr_value = wrap_method(attr_value)
             new_dict[attr_name] = attr_value
 
         return type.__new__(cls, name, bases, new_dict)
 
 class DailyTradeBot(metaclass=AutoPostCallMeta):
-    def __init__(self):
-        # Setup reddit bot connection
-        self.reddit = praw.Reddit('bot1')
-        self.reddit.validate_on_submit = True
-        self.subreddit = self.reddit.subreddit("dailygames")
-    
-    _connection_is_open = False
-    _keep_open = False
-    _call_stack = []
+    def __init__(self, reddit=None, database="reddit_game.db", connection_factory=sqlite3.Connection):
+        # Any object with the same interface as praw.Reddit can be passed instead of the reddit bot connection (see fake_reddit.py)
+        self._reddit = reddit
+        if reddit is not None:
+            reddit.validate_on_submit = True
+        self._reddit_site = 'bot1' if reddit is None else None
+        self._thread_reddits = threading.local()
+        self._subreddit = None
+        self.profiler = Profiler()
+        self.connections = ConnectionManager(database, factory=connection_factory, trace_callback=self.profiler.sql_statement)
+        self.render_cache = RenderCache()
+        self.backups = BackupStore()
+        self.clear_run_caches()
+
+    # Number of subreddits that are crawled at the same time, and the shared request budget of the crawl
+    crawl_workers = 8
+    crawl_requests_per_minute = 90
+    # Number of processes that render the report images at the same time
+    render_workers = min(5, os.cpu_count() or 1)
+    # Number of daily and weekly backups that are kept
+    backup_keep_daily = 7
+    backup_keep_weekly = 8
+    # Number of threads that execute the commands of different players at the same time, 1 executes comment by comment
+    execution_workers = 1
+    # Number of "load more comments" stubs that are expanded before the loaded comments are stored
+    comment_batch_size = 32
+    # Number of ledger events after which a run stores a new snapshot of the game state
+    ledger_snapshot_interval = 5000
+    # Number of streamed submissions that are stored at once, how often the stream reloads the allowed subreddits and how long submissions are kept
+    stream_batch_size = 100
+    stream_refresh_seconds = 60 * 60
+    stream_retention_days = 7
+
+    @property
+    def reddit(self):
+        # The reddit bot connection is set up on first use, so commands that only read the database do not import praw
+        if self._reddit is None:
+            self._reddit = praw.Reddit(self._reddit_site)
+            self._reddit.validate_on_submit = True
+        return self._reddit
+
+    def thread_reddit(self):
+        # praw.Reddit is not thread-safe, so every worker thread gets its own connection from the same praw.ini site.
+        # Objects that were passed in instead of a praw.Reddit, like FakeReddit, are shared by all threads.
+        if self._reddit_site is None or threading.current_thread() is threading.main_thread():
+            return self.reddit
+        if not hasattr(self._thread_reddits, 'reddit'):
+            self._thread_reddits.reddit = praw.Reddit(self._reddit_site)
+        return self._thread_reddits.reddit
+
+    @property
+    def subreddit(self):
+        if self._subreddit is None:
+            self._subreddit = self.reddit.subreddit("dailygames")
+        return self._subreddit
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close_connection()
 
     def __del__(self):
-        self.close_connection()
+        if hasattr(self, 'connections'):
+            self.close_connection()
 
     def connection_is_open(self):
-        return self._connection_is_open
+        return self.connections.is_open()
     
     def open_connection(self):
-        if self.connection_is_open():
-            return
-        self._connection_is_open = True
-        self._conn = sqlite3.connect("reddit_game.db")
-        self._cursor = self._conn.cursor()
-
-    def handle_connection(self, keep_open):
-        if not keep_open:
-            self.close_connection()
+        self.connections.connection()
 
     def close_connection(self):
-        if self.connection_is_open():
-            self._conn.close()
-            self._connection_is_open = False
+        self.connections.close_all()
     
     def conn(self):
-        self.open_connection()
-        return self._conn
+        return self.connections.connection()
 
     def cursor(self):
-        self.open_connection()
-        return self._cursor
+        return self.connections.cursor()
+
+    def commit(self):
+        self.connections.commit()
+
+    def unit_of_work(self):
+        return self.connections.unit_of_work()
+
+    def savepoint(self):
+        return self.connections.savepoint()
 
     def setup_database(self):
+        self.cursor().execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table'")
+        new_database = self.cursor().fetchone()[0] == 0
+
         self.cursor().execute('''
             CREATE TABLE IF NOT EXISTS posts (
                 post_id TEXT PRIMARY KEY,
@@ -91,16 +790,23 @@ class DailyTradeBot(metaclass=AutoPostCallMeta):
         self.cursor().execute('''
             CREATE TABLE IF NOT EXISTS gems (
                 username TEXT,
-                gems TEXT,
-                date DATE,
-                PRIMARY KEY (username, date)
+                gems INTEGER,
+                date DATE
+            )
+        ''')
+        self.cursor().execute("CREATE INDEX IF NOT EXISTS gems_username ON gems (username, date)")
+        self.cursor().execute('''
+            CREATE TABLE IF NOT EXISTS balances (
+                username TEXT PRIMARY KEY,
+                gems INTEGER,
+                updated DATE
             )
         ''')
         self.cursor().execute('''
             CREATE TABLE IF NOT EXISTS stocks (
                 username TEXT,
                 subreddit TEXT,
-                amount TEXT,
+                amount INTEGER,
                 value FLOAT,
                 PRIMARY KEY (username, subreddit)
             )
@@ -109,7 +815,7 @@ class DailyTradeBot(metaclass=AutoPostCallMeta):
             CREATE TABLE IF NOT EXISTS trades (
                 username TEXT,
                 subreddit TEXT,
-                amount TEXT,
+                amount INTEGER,
                 value FLOAT,
                 date DATE,
                 type TEXT,
@@ -119,13 +825,13 @@ class DailyTradeBot(metaclass=AutoPostCallMeta):
         self.cursor().execute('''
             CREATE TABLE IF NOT EXISTS loans (
                 username TEXT PRIMARY KEY,
-                amount TEXT
+                amount INTEGER
             )
         ''')
         self.cursor().execute('''
             CREATE TABLE IF NOT EXISTS loans_backup (
                 username TEXT,
-                amount TEXT,
+                amount INTEGER,
                 type TEXT,
                 date DATE,
                 PRIMARY KEY (username, date, type)
@@ -138,15 +844,133 @@ class DailyTradeBot(metaclass=AutoPostCallMeta):
                 PRIMARY KEY (comment_id, date)
             )
         ''')
+        self.cursor().execute('''
+            CREATE TABLE IF NOT EXISTS change_log (
+                date DATE,
+                username TEXT,
+                message TEXT
+            )
+        ''')
+        self.cursor().execute('''
+            CREATE TABLE IF NOT EXISTS completed_steps (
+                step TEXT,
+                date DATE,
+                PRIMARY KEY (step, date)
+            )
+        ''')
         self.cursor().execute('''
             CREATE TABLE IF NOT EXISTS posts_per_subreddit (
-                subreddit TEXT,
+                subreddit TEXT COLLATE NOCASE,
                 date DATE,
                 posts INT,
                 PRIMARY KEY (subreddit, date)
             )
         ''')
-        self.conn().commit()
+        self.cursor().execute('''
+            CREATE TABLE IF NOT EXISTS user_posts_per_subreddit (
+                username TEXT,
+                subreddit TEXT COLLATE NOCASE,
+                date DATE,
+                posts INT,
+                PRIMARY KEY (username, subreddit, date)
+            )
+        ''')
+        self.cursor().execute('''
+            CREATE TABLE IF NOT EXISTS staged_comments (
+                comment_id TEXT PRIMARY KEY,
+                post_id TEXT,
+                author TEXT,
+                body TEXT,
+                created_utc FLOAT
+            )
+        ''')
+        self.cursor().execute('''
+            CREATE TABLE IF NOT EXISTS comment_ingest (
+                post_id TEXT PRIMARY KEY,
+                complete INTEGER,
+                remaining_stubs INTEGER,
+                updated TEXT
+            )
+        ''')
+        self.cursor().execute('''
+            CREATE TABLE IF NOT EXISTS ledger (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                date DATE,
+                username TEXT,
+                event TEXT,
+                subreddit TEXT,
+                gems INTEGER,
+                amount INTEGER,
+                value FLOAT,
+                loan INTEGER
+            )
+        ''')
+        self.cursor().execute('''
+            CREATE TABLE IF NOT EXISTS ledger_snapshots (
+                ledger_id INTEGER PRIMARY KEY,
+                date DATE,
+                state TEXT
+            )
+        ''')
+        self.cursor().execute('''
+            CREATE TABLE IF NOT EXISTS allowed_subreddits (
+                subreddit TEXT COLLATE NOCASE PRIMARY KEY,
+                added DATE,
+                added_by TEXT
+            )
+        ''')
+        self.cursor().execute('''
+            CREATE TABLE IF NOT EXISTS submissions (
+                submission_id TEXT PRIMARY KEY,
+                subreddit TEXT COLLATE NOCASE,
+                author TEXT COLLATE NOCASE,
+                created_utc FLOAT
+            )
+        ''')
+        self.cursor().execute("CREATE INDEX IF NOT EXISTS submissions_subreddit ON submissions (subreddit, created_utc)")
+        self.cursor().execute('''
+            CREATE TABLE IF NOT EXISTS submission_stream (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                started INTEGER,
+                last_seen INTEGER
+            )
+        ''')
+        self.cursor().execute('''
+            CREATE TABLE IF NOT EXISTS submission_stream_subreddits (
+                stream_id INTEGER,
+                subreddit TEXT COLLATE NOCASE,
+                followed_from INTEGER,
+                followed_until INTEGER
+            )
+        ''')
+        self.cursor().execute("CREATE INDEX IF NOT EXISTS submission_stream_subreddits_stream ON submission_stream_subreddits (stream_id)")
+        if new_database:
+            # The tables above already have the latest schema
+            self.cursor().execute(SEED_ALLOWED_SUBREDDITS)
+            self.cursor().execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self.commit()
+        self.migrate_database()
+
+        # The ledger starts from the state of the game when it was introduced
+        self.cursor().execute("SELECT 1 FROM ledger_snapshots LIMIT 1")
+        if self.cursor().fetchone() is None:
+            with self.unit_of_work():
+                self.snapshot_ledger(self.state_from_tables())
+
+    def schema_version(self):
+        self.cursor().execute("PRAGMA user_version")
+        return self.cursor().fetchone()[0]
+
+    def migrate_database(self):
+        version = self.schema_version()
+        if version > SCHEMA_VERSION:
+            raise RuntimeError(f"Database schema version {version} is newer than the supported version {SCHEMA_VERSION}")
+        for version in range(version, SCHEMA_VERSION):
+            print(f"Migrating database to schema version {version + 1}")
+            with self.unit_of_work():
+                for statement in MIGRATIONS[version]:
+                    self.cursor().execute(statement)
+                self.cursor().execute(f"PRAGMA user_version = {version + 1}")
 
     def run_sql_queries(self, queries):
         for query in queries:
@@ -154,13 +978,13 @@ class DailyTradeBot(metaclass=AutoPostCallMeta):
 
     def run_sql_query(self, query):
         print("Running SQL query:", query)
-        self.cursor(keep_open=True).execute(query)
-        self.conn().commit()
+        self.cursor().execute(query)
+        self.commit()
 
     def backup_database(self, for_restoration=False):
-        addition = " for restoration" if for_restoration else ""
-        shutil.copy2('reddit_game.db', f"reddit_game {datetime.now().strftime('%Y-%m-%d %H.%M.%S')}{addition}.db")
-        print("Created database backup")
+        metadata = self.backups.create(self.conn(), for_restoration)
+        print(f"Created database backup {metadata['file']} ({metadata['compressed_size'] / 1024:.0f} KiB)")
+        self.backups.prune(self.backup_keep_daily, self.backup_keep_weekly)
 
     def restore_latest_backup(self):
         proceed = input("Do you want to restore the latest backup? (y/n): ").strip().lower()
@@ -168,14 +992,13 @@ class DailyTradeBot(metaclass=AutoPostCallMeta):
             print("Restoration cancelled.")
             return
 
-        backups = [f for f in os.listdir('.') if f.startswith('reddit_game ') and f.endswith('.db')]
-        if not backups:
+        latest_backup = self.backups.latest()
+        if latest_backup is None:
             print("No backups found.")
             return
-        latest_backup = max(backups, key=os.path.getctime)
         self.backup_database(for_restoration=True)
-        shutil.copy2(latest_backup, 'reddit_game.db')
-        print(f"Database restored from {latest_backup}.")
+        self.backups.restore(latest_backup, self.conn())
+        print(f"Database restored from {latest_backup['file']}.")
 
     def isfloat(self, num):
         try:
@@ -184,10 +1007,6 @@ class DailyTradeBot(metaclass=AutoPostCallMeta):
         except ValueError:
             return False
         
-    def add_message(self, df, username, message):
-        new_row = pd.DataFrame([[username, message]], columns=df.columns)
-        return pd.concat([df, new_row], ignore_index=True)
-    
     def get_today(self):
         return date.today().isoformat()
     
@@ -201,76 +1020,34 @@ class DailyTradeBot(metaclass=AutoPostCallMeta):
         latest_post = self.cursor().fetchone()
         post_id, post_date = latest_post
         return (post_id, post_date)
+
+    def post_is_published(self):
+        # A day gets one post, a day's run is done once its post has been published
+        _, post_date = self.get_latest_post()
+        return post_date == self.get_today()
     
     def extract_commands(self, text):
-        text = text.replace("\\","")
-        commands = []
-
-        pattern = re.compile(r'\[\s*(sell|buy)\s+([\d\.,]+|all)(?:\s+r/(\w+))?\s*\]|\[\s*(loan|pay)\s+([\d\.,]+|all)\s*\]|\[\s*(exit)\s*\]|\[(.*?)\]')
-        for match in pattern.finditer(text.lower()):
-            if match.group(1):  # sell or buy
-                commands.append({
-                    'command': match.group(1),
-                    'amount': re.sub(r"[\.,]", "", match.group(2)),
-                    'subreddit': match.group(3),
-                    'unrecognized': None
-                })
-            elif match.group(4):  # loan or pay
-                commands.append({
-                    'command': match.group(4),
-                    'amount': re.sub(r"[\.,]", "", match.group(5)),
-                    'subreddit': None,
-                    'unrecognized': None
-                })
-            elif match.group(6):  # exit
-                commands.append({
-                    'command': match.group(6),
-                    'amount': None,
-                    'subreddit': None,
-                    'unrecognized': None
-                })
-            else:  # Unrecognized command
-                commands.append({
-                    'command': None,
-                    'amount': None,
-                    'subreddit': None,
-                    'unrecognized': match.group(7)
-                })
-            
-        return pd.DataFrame(commands)
+        return parse_commands(text)
     
     def user_is_player(self, username):
-        self.cursor().execute("SELECT 1 FROM gems WHERE username = ? LIMIT 1", (username,))
+        self.cursor().execute("SELECT 1 FROM balances WHERE username = ?", (username,))
         result = self.cursor().fetchone()
         return result is not None
 
     def current_gems(self, username):
-        self.cursor().execute("""
-            SELECT gems FROM gems
-            WHERE username = ?
-            ORDER BY date DESC
-            LIMIT 1
-        """, (username,))
+        self.cursor().execute("SELECT gems FROM balances WHERE username = ?", (username,))
         gems = self.cursor().fetchone()[0]
-        return int(gems)
-    
-    def add_gems(self, username, amount):    
-        gems = self.current_gems(username)
+        return gems
 
-        self.cursor().execute("""
-            SELECT date FROM gems
-            WHERE username = ?
-            ORDER BY date DESC
-            LIMIT 1
-        """, (username,))
-        last_date = self.cursor().fetchone()[0]
+    def set_gems(self, username, gems):
+        # balances holds the current gems, every change is also added to the gems history
         today = self.get_today()
-
-        if today == last_date:     
-            self.cursor().execute("UPDATE gems SET gems = ? WHERE username = ? AND date = ?", (str(gems + amount), username, today))
-        else:
-            self.cursor().execute("INSERT INTO gems (username, gems, date) VALUES (?, ?, ?)", (username, str(gems + amount), today))
-        self.conn().commit()
+        self.cursor().execute("INSERT OR REPLACE INTO balances (username, gems, updated) VALUES (?, ?, ?)", (username, gems, today))
+        self.cursor().execute("INSERT INTO gems (username, gems, date) VALUES (?, ?, ?)", (username, gems, today))
+    
+    def add_gems(self, username, amount):    
+        self.set_gems(username, self.current_gems(username) + amount)
+        self.commit()
 
     def has_stocks(self, username, subreddit):
         self.cursor().execute("""
@@ -295,78 +1072,292 @@ class DailyTradeBot(metaclass=AutoPostCallMeta):
         return int(dt_object.timestamp())
 
     def get_posts_before_date(self, subreddit, date, username = None):
+        started = time.perf_counter()
         self.cursor().execute("""
-            SELECT 1 FROM posts_per_subreddit
-            WHERE LOWER(subreddit) = LOWER(?) AND date = ?
+            SELECT posts FROM posts_per_subreddit
+            WHERE subreddit = ? AND date = ?
         """, (subreddit,date,))
-        has_been_found = self.cursor().fetchone() is not None
+        result = self.cursor().fetchone()
+        has_been_found = result is not None
 
         if has_been_found:
-            self.cursor().execute("""
-                SELECT posts FROM posts_per_subreddit
-                WHERE LOWER(subreddit) = LOWER(?) AND date = ?
-            """, (subreddit,date,))
-            n_posts = self.cursor().fetchone()[0]
+            n_posts = result[0]
             if username is None:
+                self.profiler.time('get_posts_before_date', 'stored', time.perf_counter() - started)
                 return n_posts
         elif username is not None:
             raise Exception(f'I cannot find the post count of this subreddit ({subreddit}) and this user ({username}) on this date ({date}) yet!')
 
-        nTries = 0
-        while nTries < 20:
-            try:
-                end_date = datetime.strptime(date, "%Y-%m-%d") 
-
-                end_datetime = datetime(end_date.year, end_date.month, end_date.day, 5, 0)
-                start_datetime = end_datetime - timedelta(hours=24)
-
-                start_timestamp = int(start_datetime.timestamp())
-                end_timestamp = int(end_datetime.timestamp())
-
-                # Count the number of posts in the time range
-                post_count = 0
-                
-                if has_been_found:
-                    user = self.reddit.redditor(username)
-                    for submission in user.submissions.new():
-                        if submission.subreddit == subreddit and start_timestamp <= submission.created_utc < end_timestamp:
-                            post_count += 1
-                    return n_posts - post_count
-                else:
-                    praw_subreddit = self.reddit.subreddit(subreddit)
-
-                    # Loop through submissions in the subreddit
-                    for submission in praw_subreddit.new(limit=1000):  # Use .new() to iterate through posts
-                        if start_timestamp <= submission.created_utc < end_timestamp:
-                            post_count += 1
-                        if submission.created_utc < start_timestamp:  # Stop early if past range
-                            break
-                    return post_count
-            except prawcore.exceptions.ServerError:
-                print('Server error occurred, trying again in 10 seconds')
-                time.sleep(10)
-                nTries += 1
-        raise Exception('20 server errors occured!')
+        start_timestamp, end_timestamp = post_window(date)
+        if self.stream_covers(subreddit, start_timestamp, end_timestamp):
+            n_posts = self.count_streamed_posts(subreddit, start_timestamp, end_timestamp, excluded_author=username)
+            self.profiler.time('get_posts_before_date', 'stream', time.perf_counter() - started)
+            return n_posts
+        if has_been_found:
+            n_posts -= self.get_own_posts(username, subreddit, date)
+            self.profiler.time('get_posts_before_date', 'stored minus own posts', time.perf_counter() - started)
+            return n_posts
+        request_counter = RateLimiter()
+        n_posts = retry_on_server_error(count_subreddit_posts, self.thread_reddit(), subreddit, start_timestamp, end_timestamp, request_counter)
+        self.profiler.count('api_calls', 'subreddit listing pages', request_counter.requests)
+        self.profiler.time('get_posts_before_date', 'crawl', time.perf_counter() - started)
+        return n_posts
+
+    def get_own_posts(self, username, subreddit, date):
+        self.cursor().execute("""
+            SELECT posts FROM user_posts_per_subreddit
+            WHERE username = ? AND subreddit = ? AND date = ?
+        """, (username,subreddit,date,))
+        result = self.cursor().fetchone()
+        if result is not None:
+            return result[0]
+
+        start_timestamp, end_timestamp = post_window(date)
+        own_posts = retry_on_server_error(self.count_own_posts, username, subreddit, start_timestamp, end_timestamp)
+        self.cursor().execute("INSERT OR IGNORE INTO user_posts_per_subreddit (username, subreddit, date, posts) VALUES (?, ?, ?, ?)", (username, subreddit, date, own_posts))
+        self.commit()
+        return own_posts
+
+    def get_user_posts_per_subreddit(self, date):
+        print("Get own posts of stock holders")
+
+        self.cursor().execute("""
+            SELECT DISTINCT s.username, s.subreddit FROM stocks s
+            WHERE NOT EXISTS (
+                SELECT 1 FROM user_posts_per_subreddit u
+                WHERE u.username = s.username AND u.subreddit = s.subreddit AND u.date = ?
+            )
+        """, (date,))
+        holdings = self.cursor().fetchall()
+
+        start_timestamp, end_timestamp = post_window(date)
+        rows = [(username, subreddit, date, retry_on_server_error(self.count_own_posts, username, subreddit, start_timestamp, end_timestamp)) for username, subreddit in holdings]
+        self.cursor().executemany("INSERT OR IGNORE INTO user_posts_per_subreddit (username, subreddit, date, posts) VALUES (?, ?, ?, ?)", rows)
+        self.commit()
+
+    def clear_run_caches(self):
+        # Submission history of each redditor, and their number of posts per subreddit per time window
+        self._submission_history = {}
+        self._own_post_counts = {}
+        self._allowed_subreddits = None
+        self._allowed_subreddit_names = frozenset()
+        self._moderators = None
+        self._stream_coverage = {}
+
+    def stream_covers(self, subreddit, start_timestamp, end_timestamp):
+        # The stream only has every submission of a subreddit in a time window if one ingest session followed the subreddit from start to end
+        window = (start_timestamp, end_timestamp)
+        if window not in self._stream_coverage:
+            self.cursor().execute("""
+                SELECT DISTINCT LOWER(f.subreddit) FROM submission_stream s
+                JOIN submission_stream_subreddits f ON f.stream_id = s.id
+                WHERE f.followed_from <= ? AND s.last_seen >= ? AND (f.followed_until IS NULL OR f.followed_until >= ?)
+            """, (start_timestamp, end_timestamp, end_timestamp))
+            self._stream_coverage[window] = frozenset(row[0] for row in self.cursor().fetchall())
+        return subreddit.lower() in self._stream_coverage[window]
+
+    def count_streamed_posts(self, subreddit, start_timestamp, end_timestamp, excluded_author=None):
+        if excluded_author is None:
+            self.cursor().execute("""
+                SELECT COUNT(*) FROM submissions
+                WHERE subreddit = ? AND created_utc >= ? AND created_utc < ?
+            """, (subreddit, start_timestamp, end_timestamp))
+        else:
+            self.cursor().execute("""
+                SELECT COUNT(*) FROM submissions
+                WHERE subreddit = ? AND created_utc >= ? AND created_utc < ? AND author IS NOT ?
+            """, (subreddit, start_timestamp, end_timestamp, excluded_author))
+        return self.cursor().fetchone()[0]
+
+    def count_own_posts(self, username, subreddit, start_timestamp, end_timestamp):
+        window = (username, start_timestamp, end_timestamp)
+        if self.stream_covers(subreddit, start_timestamp, end_timestamp):
+            self.cursor().execute("""
+                SELECT COUNT(*) FROM submissions
+                WHERE subreddit = ? AND created_utc >= ? AND created_utc < ? AND author = ?
+            """, (subreddit, start_timestamp, end_timestamp, username))
+            return self.cursor().fetchone()[0]
+        if window not in self._own_post_counts:
+            if username not in self._submission_history:
+                user = self.thread_reddit().redditor(username)
+                self.profiler.count('api_calls', 'redditor submissions')
+                self._submission_history[username] = [(str(submission.subreddit).lower(), submission.created_utc) for submission in user.submissions.new()]
+            post_counts = {}
+            for submission_subreddit, created_utc in self._submission_history[username]:
+                if start_timestamp <= created_utc < end_timestamp:
+                    post_counts[submission_subreddit] = post_counts.get(submission_subreddit, 0) + 1
+            self._own_post_counts[window] = post_counts
+        return self._own_post_counts[window].get(subreddit.lower(), 0)
 
     def allowed_subreddits(self):
-        words = ['dailygames','notinteresting', 'learnpython', 'mildlyinfuriating', '196', '3Blue1Brown', 'AmIOverreacting', 'AmITheAsshole', 'Angryupvote', 'Animal', 'animation', 'antimeme', 'anythingbutmetric', 'AskOuija', 'assholedesign', 'BeAmazed', 'birdification', 'birthofasub', 'blursedimages', 'brandnewsentence', 'capybara', 'chemistrymemes', 'clevercomebacks', 'confidentlyincorrect', 'copypasta', 'countablepixels', 'Damnthatsinteresting', 'dataisbeautiful', 'DnD', 'dndmemes', 'ExplainTheJoke', 'facepalm', 'Fantasy', 'foundsatan', 'foundthemobileuser', 'FreeCompliments', 'gameofthrones', 'geocaching', 'girlsarentreal', 'GuysBeingDudes', 'iamverysmart', 'ididnthaveeggs', 'ihadastroke', 'im14andthisisdeep', 'interesting', 'interestingasfuck', 'LeftTheBurnerOn', 'LetGirlsHaveFun', 'lfg', 'lgbt', 'lies', 'linguisticshumor', 'LinkedInLunatics', 'lostredditors', 'MadeMeSmile', 'mapporncirclejerk', 'MathJokes', 'mathmemes', 'meirl', 'meme', 'memes', 'mildlyinteresting', 'MurderedByWords', 'nature', 'Nicegirls', 'NoahGetTheBoat', 'NonPoliticalTwitter', 'oddlyspecific', 'offmychest', 'onejob', 'penpals', 'PeterExplainsTheJoke', 'pettyrevenge', 'physicsmemes', 'politics', 'PrematureTruncation', 'rareinsults', 'rpg', 'screenshotsarehard', 'softwaregore', 'sssdfg', 'SUBREDDITNAME', 'technicallythetruth', 'teenagersbutbetter', 'thatHappened', 'theydidthemath', 'Tinder', 'trolleyproblem', 'TwoSentenceHorror', 'vexillologycirclejerk', 'circlejerk', 'WeirdEggs', 'Whatcouldgowrong', 'whatisthisthing', 'woosh', 'wordle', 'AnarchyChess', 'shittydarksouls', 'KitchenConfidential', 'CountOnceADay', 'countwithchickenlady', 'SquaredCircle', 'chess', 'Warhammer40k', 'PrimarchGFs', 'SpeedOfLobsters']
-        return sorted(words, key=str.lower)
+        # Loaded once per run, clear_run_caches() loads them again
+        if self._allowed_subreddits is None:
+            self.cursor().execute("SELECT subreddit FROM allowed_subreddits ORDER BY subreddit")
+            self._allowed_subreddits = [row[0] for row in self.cursor().fetchall()]
+            self._allowed_subreddit_names = frozenset(subreddit.lower() for subreddit in self._allowed_subreddits)
+        return self._allowed_subreddits
 
     def is_allowed_subreddit(self, subreddit):
-        return subreddit.lower() in [word.lower() for word in self.allowed_subreddits()]
-    
+        self.allowed_subreddits()
+        return subreddit.lower() in self._allowed_subreddit_names
+
+    def is_moderator(self, username):
+        if self._moderators is None:
+            self._moderators = frozenset(str(moderator).lower() for moderator in self.subreddit.moderator())
+            self.profiler.count('api_calls', 'moderators')
+        return username.lower() in self._moderators
+
+    def subreddit_is_listed(self, subreddit):
+        # The list in the database, which can differ from the list of this run after [allow r/...] or [disallow r/...]
+        self.cursor().execute("SELECT 1 FROM allowed_subreddits WHERE subreddit = ?", (subreddit,))
+        return self.cursor().fetchone() is not None
+
+    # Changes to the list only apply from the next run on, allowed_subreddits() keeps the list that this run started with
+    def allow_subreddit(self, username, subreddit):
+        if not self.is_moderator(username):
+            return f"{username} tried to add r/{subreddit} to the list of allowed subreddits, but only moderators can change this list. No action has been taken."
+        if self.subreddit_is_listed(subreddit):
+            return f"{username} tried to add r/{subreddit} to the list of allowed subreddits, but it is already allowed."
+        self.cursor().execute("INSERT INTO allowed_subreddits (subreddit, added, added_by) VALUES (?, ?, ?)", (subreddit, self.get_today(), username))
+        self.commit()
+        return f"{username} added r/{subreddit} to the list of allowed subreddits. Its stocks can be bought from the next post on."
+
+    def disallow_subreddit(self, username, subreddit):
+        if not self.is_moderator(username):
+            return f"{username} tried to remove r/{subreddit} from the list of allowed subreddits, but only moderators can change this list. No action has been taken."
+        if not self.subreddit_is_listed(subreddit):
+            return f"{username} tried to remove r/{subreddit} from the list of allowed subreddits, but it is not in the list."
+        self.cursor().execute("DELETE FROM allowed_subreddits WHERE subreddit = ?", (subreddit,))
+        self.commit()
+        return f"{username} removed r/{subreddit} from the list of allowed subreddits. From the next post on, stocks of this subreddit can no longer be bought, but they can still be sold."
+
+    def counted_subreddits(self):
+        # Subreddits that are no longer allowed are still counted while players own their stocks, so they can be sold
+        self.cursor().execute("SELECT DISTINCT subreddit FROM stocks")
+        held_subreddits = [row[0] for row in self.cursor().fetchall() if not self.is_allowed_subreddit(row[0])]
+        return self.allowed_subreddits() + sorted(set(held_subreddits))
+
     def get_posts_per_subreddit(self, date):
         print("Get posts per subreddit")
 
-        for i, subreddit in enumerate(self.allowed_subreddits()):
-            print(f"Checking subreddit {i+1} out of {len(self.allowed_subreddits())}")
-            n_posts = self.get_posts_before_date(subreddit, date)
-            self.cursor().execute("INSERT OR IGNORE INTO posts_per_subreddit (subreddit, date, posts) VALUES (?, ?, ?)", (subreddit, date, n_posts))
-            self.conn().commit()
+        self.cursor().execute("SELECT LOWER(subreddit) FROM posts_per_subreddit WHERE date = ?", (date,))
+        known_subreddits = {row[0] for row in self.cursor().fetchall()}
+        subreddits = [subreddit for subreddit in self.counted_subreddits() if subreddit.lower() not in known_subreddits]
+
+        start_timestamp, end_timestamp = post_window(date)
+        self.crawl_timings = {}
+        streamed_subreddits = [subreddit for subreddit in subreddits if self.stream_covers(subreddit, start_timestamp, end_timestamp)]
+        if streamed_subreddits:
+            self.cursor().execute("""
+                SELECT LOWER(subreddit), COUNT(*) FROM submissions
+                WHERE created_utc >= ? AND created_utc < ?
+                GROUP BY LOWER(subreddit)
+            """, (start_timestamp, end_timestamp))
+            streamed_counts = dict(self.cursor().fetchall())
+            print(f"Counted the posts of {len(streamed_subreddits)} subreddits from the submission stream")
+            self.cursor().executemany("INSERT OR IGNORE INTO posts_per_subreddit (subreddit, date, posts) VALUES (?, ?, ?)", [(subreddit, date, streamed_counts.get(subreddit.lower(), 0)) for subreddit in streamed_subreddits])
+            self.commit()
+        # Subreddits that the stream did not follow for the whole window are crawled
+        subreddits = [subreddit for subreddit in subreddits if not self.stream_covers(subreddit, start_timestamp, end_timestamp)]
+
+        rate_limiter = RateLimiter(self.crawl_requests_per_minute)
+        post_counts = {}
+        with ThreadPoolExecutor(max_workers=self.crawl_workers) as executor:
+            futures = {executor.submit(lambda subreddit: crawl_subreddit(self.thread_reddit(), subreddit, start_timestamp, end_timestamp, rate_limiter), subreddit): subreddit for subreddit in subreddits}
+            for i, future in enumerate(as_completed(futures)):
+                subreddit = futures[future]
+                n_posts, elapsed = future.result()
+                post_counts[subreddit] = n_posts
+                self.crawl_timings[subreddit] = elapsed
+                self.profiler.time('crawl', subreddit, elapsed)
+                print(f"Checked subreddit {i+1} out of {len(subreddits)}: r/{subreddit} has {n_posts} posts ({elapsed:.2f} seconds)")
+
+        self.profiler.count('api_calls', 'subreddit listing pages', rate_limiter.requests)
+        self.cursor().executemany("INSERT OR IGNORE INTO posts_per_subreddit (subreddit, date, posts) VALUES (?, ?, ?)", [(subreddit, date, post_counts[subreddit]) for subreddit in subreddits])
+        self.commit()
+        return self.crawl_timings
+
+    def ingest_submissions(self, stop=None):
+        # Follows the new submissions of all counted subreddits until stop is set, so the daily run can count posts without a crawl
+        stop = threading.Event() if stop is None else stop
+        self.setup_database()
+        session_id = None
+        newest_created = None
+
+        while not stop.is_set():
+            self.clear_run_caches()
+            subreddits = self.counted_subreddits()
+            refresh_at = time.monotonic() + self.stream_refresh_seconds
+            self.prune_submissions()
+            stream_started = int(time.time())
+            continuous = None
+            rows = []
+            try:
+                # Without skip_existing, a restarted stream first returns the newest submissions again, oldest first.
+                # The session only continues if they reach back to the newest stored submission, otherwise submissions may be missing in between.
+                stream = self.reddit.subreddit("+".join(subreddits)).stream.submissions(pause_after=0)
+                for submission in stream:
+                    if continuous is None:
+                        # newest_created is kept when a new session starts: reaching back to a submission from before the session also covers its start
+                        continuous = session_id is not None and newest_created is not None and submission is not None and submission.created_utc <= newest_created
+                        if not continuous:
+                            session_id = self.start_stream_session(stream_started)
+                        self.follow_subreddits(session_id, subreddits, stream_started)
+                    if submission is not None:
+                        rows.append((submission.id, str(submission.subreddit), None if submission.author is None else str(submission.author), submission.created_utc))
+                        newest_created = submission.created_utc if newest_created is None else max(newest_created, submission.created_utc)
+                    if submission is None or len(rows) >= self.stream_batch_size:
+                        self.store_streamed_submissions(session_id, rows, caught_up=submission is None)
+                        rows = []
+                    if stop.is_set() or time.monotonic() >= refresh_at:
+                        break
+            except prawcore.exceptions.PrawcoreException:
+                traceback.print_exc()
+                print("The submission stream was interrupted, trying again in 10 seconds")
+                stop.wait(10)
+            if rows:
+                self.store_streamed_submissions(session_id, rows, caught_up=False)
+        print(f"Stopped submission stream session {session_id}")
+
+    def start_stream_session(self, started):
+        self.cursor().execute("INSERT INTO submission_stream (started, last_seen) VALUES (?, ?)", (started, started))
+        session_id = self.cursor().lastrowid
+        self.commit()
+        print(f"Started submission stream session {session_id}")
+        return session_id
+
+    def follow_subreddits(self, session_id, subreddits, followed_from):
+        # Subreddits that joined the stream are only covered from the time the new stream was created, subreddits that left until then
+        self.cursor().execute("SELECT subreddit FROM submission_stream_subreddits WHERE stream_id = ? AND followed_until IS NULL", (session_id,))
+        followed = {row[0].lower() for row in self.cursor().fetchall()}
+        names = {subreddit.lower() for subreddit in subreddits}
+        self.cursor().executemany("UPDATE submission_stream_subreddits SET followed_until = ? WHERE stream_id = ? AND subreddit = ? AND followed_until IS NULL",
+                                  [(followed_from, session_id, subreddit) for subreddit in followed - names])
+        self.cursor().executemany("INSERT INTO submission_stream_subreddits (stream_id, subreddit, followed_from) VALUES (?, ?, ?)",
+                                  [(session_id, subreddit, followed_from) for subreddit in subreddits if subreddit.lower() not in followed])
+        self.commit()
+
+    def store_streamed_submissions(self, session_id, rows, caught_up):
+        # Every stored batch also moves the end of the time window that the session covers.
+        # Once the stream has caught up that is now, before that only the submissions up to the newest stored one are complete.
+        last_seen = int(time.time()) if caught_up else int(max(row[3] for row in rows))
+        self.cursor().executemany("INSERT OR IGNORE INTO submissions (submission_id, subreddit, author, created_utc) VALUES (?, ?, ?, ?)", rows)
+        self.cursor().execute("UPDATE submission_stream SET last_seen = MAX(last_seen, ?) WHERE id = ?", (last_seen, session_id))
+        self.commit()
+        self.profiler.count('stream', 'submissions', len(rows))
+
+    def prune_submissions(self):
+        # Old windows have been counted into posts_per_subreddit already
+        cutoff = time.time() - self.stream_retention_days * 86400
+        self.cursor().execute("DELETE FROM submissions WHERE created_utc < ?", (cutoff,))
+        self.cursor().execute("DELETE FROM submission_stream WHERE last_seen < ?", (cutoff,))
+        self.cursor().execute("DELETE FROM submission_stream_subreddits WHERE stream_id NOT IN (SELECT id FROM submission_stream)")
+        self.commit()
 
     def add_player(self, username):
-        self.cursor().execute("INSERT INTO gems (username, gems, date) VALUES (?, 1000, ?)", (username, self.get_today()))
-        self.conn().commit()
+        self.set_gems(username, 1000)
+        self.record_event(username, 'join', gems=1000)
+        self.commit()
         return f"A new player: {username}, has joined. Welcome! You received 1000 gems."
     
     def unknown_command(self, username, command):
@@ -405,9 +1396,10 @@ class DailyTradeBot(metaclass=AutoPostCallMeta):
         
         self.add_gems(username,-1*amount)
         
-        self.cursor().execute("INSERT INTO trades (username, subreddit, amount, value, date, type) VALUES (?, ?, ?, ?, ?, ?)", (username, subreddit, str(amount), 1/number_of_posts, date, "purchase"))
-        self.cursor().execute("INSERT INTO stocks (username, subreddit, amount, value) VALUES (?, ?, ?, ?)", (username, subreddit, str(amount), 1/number_of_posts))
-        self.conn().commit()
+        self.cursor().execute("INSERT INTO trades (username, subreddit, amount, value, date, type) VALUES (?, ?, ?, ?, ?, ?)", (username, subreddit, amount, 1/number_of_posts, date, "purchase"))
+        self.cursor().execute("INSERT INTO stocks (username, subreddit, amount, value) VALUES (?, ?, ?, ?)", (username, subreddit, amount, 1/number_of_posts))
+        self.record_event(username, 'buy', subreddit, gems=-1*amount, amount=amount, value=1/number_of_posts)
+        self.commit()
         
         post_number_text = f"There have been {number_of_posts} posts (not posted by {username})"
         if number_of_posts == 1:
@@ -446,9 +1438,10 @@ class DailyTradeBot(metaclass=AutoPostCallMeta):
                 current_value = 0
             else:
                 current_value = 1/number_of_posts
-            self.cursor().execute("INSERT INTO trades (username, subreddit, amount, value, date, type) VALUES (?, ?, ?, ?, ?, ?)", (username, row['subreddit'], str(-1*row_amount), current_value, date, "sale"))
+            self.cursor().execute("INSERT INTO trades (username, subreddit, amount, value, date, type) VALUES (?, ?, ?, ?, ?, ?)", (username, row['subreddit'], -1*row_amount, current_value, date, "sale"))
             self.cursor().execute("DELETE FROM stocks WHERE username = ? AND subreddit = ?", (username, row['subreddit']))
-            self.conn().commit()
+            self.record_event(username, 'sell', row['subreddit'], gems=gems, amount=-1*row_amount, value=current_value)
+            self.commit()
             
         end_of_message = ""
         if total_gems-total_amount == 1:
@@ -477,7 +1470,6 @@ class DailyTradeBot(metaclass=AutoPostCallMeta):
             AND subreddit = ?
         """, (username,subreddit,))
         number_of_stocks, value = self.cursor().fetchone()
-        number_of_stocks = int(number_of_stocks)
         value = float(value)
         if amount == "all":
             amount = number_of_stocks
@@ -510,12 +1502,13 @@ class DailyTradeBot(metaclass=AutoPostCallMeta):
             current_value = 0
         else:
             current_value = 1/number_of_posts
-        self.cursor().execute("INSERT INTO trades (username, subreddit, amount, value, date, type) VALUES (?, ?, ?, ?, ?, ?)", (username, subreddit, str(-1*amount), current_value, date, "sale"))
+        self.cursor().execute("INSERT INTO trades (username, subreddit, amount, value, date, type) VALUES (?, ?, ?, ?, ?, ?)", (username, subreddit, -1*amount, current_value, date, "sale"))
         if amount == number_of_stocks:   
             self.cursor().execute("DELETE FROM stocks WHERE username = ? AND subreddit = ?", (username, subreddit))
         else:
             self.cursor().execute("UPDATE stocks SET amount = ? WHERE username = ? AND subreddit = ?", (number_of_stocks - amount, username, subreddit))                
-        self.conn().commit()
+        self.record_event(username, 'sell', subreddit, gems=gems, amount=-1*amount, value=current_value)
+        self.commit()
         
         end_of_message = ""
         if gems-amount == 1:
@@ -549,22 +1542,23 @@ class DailyTradeBot(metaclass=AutoPostCallMeta):
         
         self.add_gems(username, amount)
 
-        self.cursor().execute("INSERT INTO loans_backup (username, amount, type, date) VALUES (?, ?, ?, ?)", (username, str(amount), 'loan', date))
-        self.conn().commit()
+        self.cursor().execute("INSERT INTO loans_backup (username, amount, type, date) VALUES (?, ?, ?, ?)", (username, amount, 'loan', date))
+        self.commit()
         if self.has_loan(username):
             self.cursor().execute("""
                 SELECT amount FROM loans
                 WHERE username = ?
             """, (username,))
-            current_loan = int(self.cursor().fetchone()[0])
-            self.cursor().execute("UPDATE loans SET amount = ? WHERE username = ?", (str(current_loan + amount), username))                        
+            current_loan = self.cursor().fetchone()[0]
+            self.cursor().execute("UPDATE loans SET amount = ? WHERE username = ?", (current_loan + amount, username))                        
         else:
-            self.cursor().execute("INSERT INTO loans (username, amount) VALUES (?, ?)", (username, str(amount)))
-        self.conn().commit()
+            self.cursor().execute("INSERT INTO loans (username, amount) VALUES (?, ?)", (username, amount))
+        self.record_event(username, 'loan', gems=amount, loan=amount)
+        self.commit()
 
         return f"{username} took a loan of {amount} gems. They will have to pay an interest of {round(amount*0.05)} gems each day."
 
-    def pay(self, username, amount):
+    def pay(self, username, amount, date):
         self.cursor().execute("""
             SELECT 1 FROM loans_backup
             WHERE username = ?
@@ -585,7 +1579,7 @@ class DailyTradeBot(metaclass=AutoPostCallMeta):
             SELECT amount FROM loans
             WHERE username = ?
         """, (username,))
-        current_loan = int(self.cursor().fetchone()[0])
+        current_loan = self.cursor().fetchone()[0]
 
         if amount == "all":
             amount = current_loan
@@ -600,70 +1594,331 @@ class DailyTradeBot(metaclass=AutoPostCallMeta):
         
         self.add_gems(username, amount*-1)
 
-        self.cursor().execute("INSERT INTO loans_backup (username, amount, type, date) VALUES (?, ?, ?, ?)", (username, str(amount), 'payment', date))
-        self.conn().commit()
+        self.cursor().execute("INSERT INTO loans_backup (username, amount, type, date) VALUES (?, ?, ?, ?)", (username, amount, 'payment', date))
+        self.commit()
         if amount == current_loan:
             self.cursor().execute("DELETE FROM loans WHERE username = ?", (username,))
         else:
-            self.cursor().execute("UPDATE loans SET amount = ? WHERE username = ?", (str(current_loan - amount), username))                        
-        self.conn().commit()
+            self.cursor().execute("UPDATE loans SET amount = ? WHERE username = ?", (current_loan - amount, username))                        
+        self.record_event(username, 'payment', gems=-1*amount, loan=-1*amount)
+        self.commit()
         
         return f"{username} paid off {amount} gems of their loan. Now {current_loan - amount} gems are left in their loan. They will have to pay an interest of {round((current_loan-amount)*0.05)} gems each day."
     
     def exit_game(self, username):
-        self.cursor().execute("DELETE FROM gems WHERE username = ?", (username,))
+        # The gems history is append-only, so only the current balance is removed
+        self.cursor().execute("DELETE FROM balances WHERE username = ?", (username,))
         self.cursor().execute("DELETE FROM stocks WHERE username = ?", (username,))
         self.cursor().execute("DELETE FROM trades WHERE username = ?", (username,))
         self.cursor().execute("DELETE FROM loans WHERE username = ?", (username,))
         self.cursor().execute("DELETE FROM loans_backup WHERE username = ?", (username,))
-        self.conn().commit()
+        self.record_event(username, 'exit')
+        self.commit()
 
         return f"{username} decided to exit the game. Their information has been deleted. Sorry to see you go. You're always welcome to join and start over again!"
     
     def execute_commands(self, username, commands):
         if username in ['B0tRank', 'WhyNotCollegeBoard', 'sneakpeekbot']:
             return
-        df = pd.DataFrame(columns=["username", "message"])
+        change_log = ChangeLog()
         if len(commands) == 0:
             return
         if not self.user_is_player(username):
             result = self.add_player(username)
-            df = self.add_message(df,username,result)
-        for index, row in commands.iterrows():
+            change_log.add(username, result)
+        _, latest_post_date = self.get_latest_post()
+        for index, command in enumerate(commands):
             print(f"Currently working on command {index+1} out of {len(commands)}")
-            _, latest_post_date = self.get_latest_post(keep_open=True)
-            if row['command'] == 'buy':
-                result = self.buy(username, row['amount'], row['subreddit'], latest_post_date)
-                df = self.add_message(df,username,result)
-            elif row['command'] == 'sell':
-                result = self.sell(username, row['amount'], row['subreddit'], latest_post_date)
-                df = self.add_message(df,username,result)
-            elif row['command'] == 'loan':
-                result = self.loan(username, row['amount'], self.get_today())
-                df = self.add_message(df,username,result)
-            elif row['command'] == 'pay':
-                result = self.pay(username, row['amount'], self.get_today())
-                df = self.add_message(df,username,result)
-            elif row['command'] == 'exit':
-                result = self.exit_game(username)
-                df = self.add_message(df,username,result)            
-            elif row['command'] is None:
-                result = self.unknown_command(username, row['unrecognized'])
-                df = self.add_message(df,username,result)
-        return df
-    
-    def format_messages(self,df):
-        grouped = df.groupby('username')['message'].apply('\n\n'.join).reset_index()
-        formatted_strings = grouped.apply(lambda row: f"u/{row['username']}\n\n{row['message']}", axis=1)
-        return '\n\n---\n'.join(formatted_strings)
-    
-    def increase_counter(self,i):
-        i[0] += 1
+            try:
+                with self.savepoint():
+                    result = COMMAND_HANDLERS[command.command](self, username, command, latest_post_date)
+            except ValueError:
+                # Only the command is cancelled, e.g. for an amount like 1e5 that is a float but not a whole number.
+                # Reddit and database errors are raised, so the unit of work of the comment rolls back and a rerun executes it again.
+                traceback.print_exc()
+                result = f"Something went wrong while executing a command of {username}. No action has been taken for this command."
+            change_log.add(username, result)
+        return change_log
+
+    def prefetch_own_posts(self, parsed_comments, date):
+        # Own post counts of every stock that may be bought or sold, so executing the commands does not have to wait for reddit
+        pairs = set()
+        selling_all = set()
+        for _, username, commands in parsed_comments:
+            for command in commands:
+                if command.command in ('buy', 'sell') and command.subreddit is not None:
+                    pairs.add((username, command.subreddit))
+                elif command.command == 'sell':
+                    selling_all.add(username)
+        for username in selling_all:
+            self.cursor().execute("SELECT subreddit FROM stocks WHERE username = ?", (username,))
+            pairs.update((username, row[0]) for row in self.cursor().fetchall())
+
+        missing = []
+        for username, subreddit in sorted(pairs):
+            self.cursor().execute("""
+                SELECT 1 FROM posts_per_subreddit p
+                WHERE p.subreddit = ? AND p.date = ? AND NOT EXISTS (
+                    SELECT 1 FROM user_posts_per_subreddit u
+                    WHERE u.username = ? AND u.subreddit = p.subreddit AND u.date = p.date
+                )
+            """, (subreddit, date, username))
+            if self.cursor().fetchone() is not None:
+                missing.append((username, subreddit))
+
+        # The submissions of a player are fetched once, so all stocks of one player are counted by the same thread
+        missing_per_user = {}
+        for username, subreddit in missing:
+            missing_per_user.setdefault(username, []).append(subreddit)
+        start_timestamp, end_timestamp = post_window(date)
+        def count_user_posts(username):
+            return [(username, subreddit, date, retry_on_server_error(self.count_own_posts, username, subreddit, start_timestamp, end_timestamp)) for subreddit in missing_per_user[username]]
+        with ThreadPoolExecutor(max_workers=self.crawl_workers) as executor:
+            rows = [row for user_rows in executor.map(count_user_posts, missing_per_user) for row in user_rows]
+        # The workers read the submission stream with their own connections, a bot that keeps running must not collect them
+        self.connections.close_finished_threads()
+        self.cursor().executemany("INSERT OR IGNORE INTO user_posts_per_subreddit (username, subreddit, date, posts) VALUES (?, ?, ?, ?)", rows)
+        self.commit()
+
+    def execute_comments(self, comments, post_date):
+        for comment_id, author, body in comments:
+            print("Working on comment by " + author + ":\n" + body)
+
+            with self.unit_of_work():
+                self.record_messages(self.execute_commands(author,self.extract_commands(body)))
+                self.cursor().execute("INSERT OR IGNORE INTO comments (comment_id, date) VALUES (?, ?)", (comment_id, post_date))
+            self.profiler.count('comments', 'processed')
+            print("\n")
+
+    def execute_comments_in_parallel(self, comments, post_date):
+        parsed_comments = [(comment_id, author, self.extract_commands(body)) for comment_id, author, body in comments]
+        if any(command.command in ('allow', 'disallow') for _, _, commands in parsed_comments for command in commands):
+            # Changes to the allowed subreddits affect all players, so the comments are executed one by one
+            print("Commands change the allowed subreddits, executing the comments one by one")
+            self.execute_comments(comments, post_date)
+            return
+        self.prefetch_own_posts(parsed_comments, post_date)
+
+        # Players never change each other's rows, so every worker executes the comments of its own players on its own copy of the database
+        comments_per_user = {}
+        for index, (_, author, _) in enumerate(parsed_comments):
+            comments_per_user.setdefault(author, []).append(index)
+        users = sorted(comments_per_user)
+        partitions = [users[i::self.execution_workers] for i in range(min(self.execution_workers, len(users)))]
+
+        self.cursor().execute("SELECT COALESCE(MAX(id), 0) FROM ledger")
+        ledger_id = self.cursor().fetchone()[0]
+        self.cursor().execute("SELECT COALESCE(MAX(rowid), 0) FROM gems")
+        gems_rowid = self.cursor().fetchone()[0]
+        copies = []
+        for _ in partitions:
+            copy = sqlite3.connect(":memory:", check_same_thread=False)
+            self.conn().backup(copy)
+            copy.set_trace_callback(self.profiler.sql_statement)
+            copies.append(copy)
+
+        results = [None] * len(parsed_comments)
+        def execute_partition(copy, partition):
+            with self.connections.bind(copy):
+                for username in partition:
+                    for index in comments_per_user[username]:
+                        with self.unit_of_work():
+                            results[index] = self.execute_commands(username, parsed_comments[index][2])
+
+        print(f"Executing {len(parsed_comments)} comments of {len(users)} players in {len(partitions)} workers")
+        try:
+            with ThreadPoolExecutor(max_workers=max(len(partitions), 1)) as executor:
+                for future in [executor.submit(execute_partition, copy, partition) for copy, partition in zip(copies, partitions)]:
+                    future.result()
+
+            # Everything is written at once, with the messages in the same order as when the comments are executed one by one
+            with self.unit_of_work():
+                for copy, partition in zip(copies, partitions):
+                    self.merge_players(copy, partition, ledger_id, gems_rowid)
+                for (comment_id, _, _), change_log in zip(parsed_comments, results):
+                    self.record_messages(change_log)
+                    self.cursor().execute("INSERT OR IGNORE INTO comments (comment_id, date) VALUES (?, ?)", (comment_id, post_date))
+        finally:
+            for copy in copies:
+                copy.close()
+        self.profiler.count('comments', 'processed', len(parsed_comments))
+
+    def merge_players(self, copy, usernames, ledger_id, gems_rowid):
+        # Replaces all rows of the players with their rows in the copy, the append-only gems history and ledger only get the new rows
+        for table in ('balances', 'stocks', 'trades', 'loans', 'loans_backup', 'user_posts_per_subreddit'):
+            for username in usernames:
+                rows = copy.execute(f"SELECT * FROM {table} WHERE username = ?", (username,)).fetchall()
+                self.cursor().execute(f"DELETE FROM {table} WHERE username = ?", (username,))
+                if rows:
+                    self.cursor().executemany(f"INSERT INTO {table} VALUES ({', '.join('?' * len(rows[0]))})", rows)
+        for username in usernames:
+            rows = copy.execute("SELECT username, gems, date FROM gems WHERE username = ? AND rowid > ? ORDER BY rowid", (username, gems_rowid)).fetchall()
+            self.cursor().executemany("INSERT INTO gems (username, gems, date) VALUES (?, ?, ?)", rows)
+        events = copy.execute("SELECT date, username, event, subreddit, gems, amount, value, loan FROM ledger WHERE id > ? ORDER BY id", (ledger_id,)).fetchall()
+        self.cursor().executemany("INSERT INTO ledger (date, username, event, subreddit, gems, amount, value, loan) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", events)
+
+    def record_event(self, username, event, subreddit=None, gems=0, amount=0, value=None, loan=0):
+        self.cursor().execute("INSERT INTO ledger (date, username, event, subreddit, gems, amount, value, loan) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                              (self.get_today(), username, event, subreddit, gems, amount, value, loan))
+
+    def state_from_tables(self):
+        state = {}
+        self.cursor().execute("SELECT username, gems FROM balances")
+        for username, gems in self.cursor().fetchall():
+            state[username] = new_player_state()
+            state[username]['gems'] = gems
+        self.cursor().execute("SELECT username, subreddit, amount, value FROM stocks")
+        for username, subreddit, amount, value in self.cursor().fetchall():
+            state.setdefault(username, new_player_state())['stocks'][subreddit] = [amount, value]
+        self.cursor().execute("SELECT username, amount FROM loans")
+        for username, amount in self.cursor().fetchall():
+            state.setdefault(username, new_player_state())['loan'] = amount
+        return state
+
+    def snapshot_ledger(self, state=None):
+        self.cursor().execute("SELECT COALESCE(MAX(id), 0) FROM ledger")
+        ledger_id = self.cursor().fetchone()[0]
+        if state is None:
+            state = self.state_at(ledger_id=ledger_id)
+        self.cursor().execute("INSERT OR REPLACE INTO ledger_snapshots (ledger_id, date, state) VALUES (?, ?, ?)", (ledger_id, self.get_today(), json.dumps(state)))
+        self.commit()
+        return ledger_id
+
+    def snapshot_ledger_if_needed(self):
+        self.cursor().execute("SELECT COUNT(*) FROM ledger WHERE id > (SELECT MAX(ledger_id) FROM ledger_snapshots)")
+        if self.cursor().fetchone()[0] >= self.ledger_snapshot_interval:
+            print(f"Created ledger snapshot at event {self.snapshot_ledger()}")
+
+    def state_at(self, date=None, ledger_id=None):
+        # Replays the events after the nearest snapshot, for the state at the end of date or right after event ledger_id
+        if ledger_id is None:
+            ledger_id = float('inf')
+        if date is None:
+            date = '9999-12-31'
+        self.cursor().execute("""
+            SELECT ledger_id, state FROM ledger_snapshots
+            WHERE date <= ? AND ledger_id <= ?
+            ORDER BY ledger_id DESC
+            LIMIT 1
+        """, (date, ledger_id))
+        snapshot = self.cursor().fetchone()
+        if snapshot is None:
+            raise ValueError(f"The ledger has no history before {date}")
+        snapshot_id, state = snapshot
+        self.cursor().execute("""
+            SELECT username, event, subreddit, gems, amount, value, loan FROM ledger
+            WHERE id > ? AND id <= ? AND date <= ?
+            ORDER BY id
+        """, (snapshot_id, ledger_id, date))
+        return apply_ledger_events(json.loads(state), self.cursor().fetchall())
+
+    def rebuild_state_from_ledger(self):
+        # Overwrites the current gems, stocks and loans with the replayed ledger
+        state = self.state_at()
+        current = self.state_from_tables()
+        changed = [username for username in state.keys() | current.keys() if state.get(username) != current.get(username)]
+        if not changed:
+            print("The game state matches the ledger.")
+            return changed
+
+        with self.unit_of_work():
+            for username in changed:
+                player = state.get(username)
+                self.cursor().execute("DELETE FROM stocks WHERE username = ?", (username,))
+                self.cursor().execute("DELETE FROM loans WHERE username = ?", (username,))
+                if player is None:
+                    self.cursor().execute("DELETE FROM balances WHERE username = ?", (username,))
+                    continue
+                self.set_gems(username, player['gems'])
+                self.cursor().executemany("INSERT INTO stocks (username, subreddit, amount, value) VALUES (?, ?, ?, ?)",
+                                          [(username, subreddit, amount, value) for subreddit, (amount, value) in player['stocks'].items()])
+                if player['loan'] != 0:
+                    self.cursor().execute("INSERT INTO loans (username, amount) VALUES (?, ?)", (username, player['loan']))
+        print(f"Rebuilt the state of {len(changed)} players from the ledger: {', '.join(sorted(changed))}")
+        return changed
+
+    def ingest_comments(self, post_id):
+        # Comments are stored in staged_comments while they are loaded, so executing the commands never waits for reddit.
+        # The staged comments are the checkpoint: an ingest that crashed, or that runs again, only expands the stubs with comments that are not staged yet.
+        self.cursor().execute("SELECT complete, remaining_stubs, updated FROM comment_ingest WHERE post_id = ?", (post_id,))
+        checkpoint = self.cursor().fetchone()
+        if checkpoint is not None:
+            complete, remaining_stubs, updated = checkpoint
+            if complete:
+                print(f"All comments of this post were loaded at {updated}, loading the comments that were posted since.")
+            else:
+                print(f"Continuing to load comments, {remaining_stubs} stubs with more comments were left at {updated}.")
+
+        self.cursor().execute("SELECT comment_id FROM staged_comments WHERE post_id = ?", (post_id,))
+        staged = {row[0] for row in self.cursor().fetchall()}
+        submission = self.reddit.submission(id=post_id)
+        self.profiler.count('api_calls', 'submission')
+        loaded = submission.comments.list()
+        stubs = []
+        while True:
+            new_comments = []
+            for comment in loaded:
+                if isinstance(comment, praw.models.MoreComments):
+                    # A stub lists the ids of the comments it hides, if they were all staged before it is not expanded.
+                    # "Continue this thread" stubs list no ids, they are always expanded.
+                    if not comment.children or not staged.issuperset(comment.children):
+                        stubs.append(comment)
+                elif comment.id not in staged:
+                    new_comments.append(comment)
+                    staged.add(comment.id)
+            self.cursor().executemany("INSERT OR IGNORE INTO staged_comments (comment_id, post_id, author, body, created_utc) VALUES (?, ?, ?, ?, ?)",
+                                      [(comment.id, post_id, None if comment.author is None else comment.author.name, comment.body, comment.created_utc) for comment in new_comments])
+            self.cursor().execute("INSERT OR REPLACE INTO comment_ingest (post_id, complete, remaining_stubs, updated) VALUES (?, ?, ?, ?)",
+                                  (post_id, len(stubs) == 0, len(stubs), datetime.now().isoformat()))
+            self.commit()
+            print(f"Loaded {len(staged)} comments, {len(stubs)} stubs with more comments left")
+            if len(stubs) == 0:
+                return
+
+            # Every stub is one request, they are expanded in batches so progress is stored in between
+            batch, stubs = stubs[:self.comment_batch_size], stubs[self.comment_batch_size:]
+            loaded = []
+            for stub in batch:
+                self.profiler.count('api_calls', 'more comments')
+                for comment in stub.comments():
+                    loaded.append(comment)
+                    if not isinstance(comment, praw.models.MoreComments):
+                        loaded.extend(comment.replies.list())
+
+    def staged_comments(self, post_id):
+        # In the order in which reddit returned them
+        self.cursor().execute("SELECT comment_id, author, body FROM staged_comments WHERE post_id = ? ORDER BY rowid", (post_id,))
+        return self.cursor().fetchall()
+
+    def record_messages(self, change_log):
+        if change_log is None or len(change_log) == 0:
+            return
+        self.cursor().executemany("INSERT INTO change_log (date, username, message) VALUES (?, ?, ?)", [(self.get_today(), entry.username, entry.message) for entry in change_log])
+        self.commit()
+
+    def get_change_log(self, date):
+        change_log = ChangeLog()
+        self.cursor().execute("SELECT username, message FROM change_log WHERE date = ? ORDER BY rowid", (date,))
+        for username, message in self.cursor().fetchall():
+            change_log.add(username, message)
+        return change_log
+
+    def processed_comment_ids(self, post_date):
+        self.cursor().execute("SELECT comment_id FROM comments WHERE date = ?", (post_date,))
+        return {row[0] for row in self.cursor().fetchall()}
+
+    def step_is_completed(self, step, date):
+        self.cursor().execute("SELECT 1 FROM completed_steps WHERE step = ? AND date = ?", (step, date))
+        return self.cursor().fetchone() is not None
+
+    def complete_step(self, step, date):
+        self.cursor().execute("INSERT OR IGNORE INTO completed_steps (step, date) VALUES (?, ?)", (step, date))
+        self.commit()
 
     def pay_interest(self,execution_date):
         df = pd.read_sql_query("SELECT username, amount FROM loans", self.conn())
         
-        messages = pd.DataFrame(columns=["username", "message"])
+        messages = ChangeLog()
         
         for _, row in df.iterrows():
             username = row['username']
@@ -672,120 +1927,85 @@ class DailyTradeBot(metaclass=AutoPostCallMeta):
             gems = self.current_gems(username)
             if gems >= interest:
                 self.add_gems(username, interest*-1)
-                messages = self.add_message(messages,username,f"{username} has paid {interest} gems as interest on their loan.")
+                self.record_event(username, 'interest', gems=-1*interest)
+                self.commit()
+                messages.add(username, f"{username} has paid {interest} gems as interest on their loan.")
             else:
                 self.add_gems(username, gems*-1)
                 loan_increase = interest - gems
-                self.cursor().execute("INSERT INTO loans_backup (username, amount, type, date) VALUES (?, ?, ?, ?)", (username, str(loan_increase), 'interest', execution_date))
-                self.conn().commit()
-                self.cursor().execute("UPDATE loans SET amount = ? WHERE username = ?", (str(amount + loan_increase), username))                        
-                self.conn().commit()
-                messages = self.add_message(messages,username,f"{username} had to pay {interest} gems as interest on their loan. They only had {gems} gems. The rest has been added to their loan. Their loan is now {amount + loan_increase} gems, so they have to pay {round((amount + loan_increase)*0.05)} gems interest per day.")   
+                self.cursor().execute("INSERT INTO loans_backup (username, amount, type, date) VALUES (?, ?, ?, ?)", (username, loan_increase, 'interest', execution_date))
+                self.commit()
+                self.cursor().execute("UPDATE loans SET amount = ? WHERE username = ?", (amount + loan_increase, username))                        
+                self.record_event(username, 'interest', gems=-1*gems, loan=loan_increase)
+                self.commit()
+                messages.add(username, f"{username} had to pay {interest} gems as interest on their loan. They only had {gems} gems. The rest has been added to their loan. Their loan is now {amount + loan_increase} gems, so they have to pay {round((amount + loan_increase)*0.05)} gems interest per day.")   
         return messages
     
-    def get_virtual_worth(self, username, date):
-        worth = self.current_gems(username)
-        query = "SELECT subreddit, amount, value FROM stocks WHERE username = ?"
-        df = pd.read_sql_query(query, self.conn(), params=(username,))
-    
-        print(f'getting virtual worth of {username}.')
-        for index, row in df.iterrows():
-            print(f"stock {index+1} out of {len(df)}.")
-            subreddit = row['subreddit']
-            amount = int(row['amount'])
-            value = row['value']
-        
-            number_of_posts = self.get_posts_before_date(subreddit, date, username)
-            worth += round(amount*number_of_posts*value)
-        print("\n")
-        return worth
-    
-    def get_current_rate(self, username, subreddit, amount, value):
-        number_of_posts = self.get_posts_before_date(subreddit, self.get_today(), username)
-        rate = round(amount*number_of_posts*value) - amount
-        if rate > 0:
-            rate = "+" + str(rate)
-        else:
-            rate = str(rate)
-        return rate
+    def get_stock_valuations(self, date):
+        self.get_user_posts_per_subreddit(date)
+
+        # Current value of every stock at once: the post count of the subreddit, minus the posts of the stock holder
+        df = pd.read_sql_query("""
+            SELECT s.username, s.subreddit, s.amount, s.value, p.posts - COALESCE(u.posts, 0) AS posts
+            FROM stocks s
+            LEFT JOIN posts_per_subreddit p
+                ON p.subreddit = s.subreddit AND p.date = ?
+            LEFT JOIN user_posts_per_subreddit u
+                ON u.username = s.username AND u.subreddit = s.subreddit AND u.date = ?
+        """, self.conn(), params=(date, date))
+
+        missing = df['posts'].isna()
+        if missing.any():
+            df.loc[missing, 'posts'] = [self.get_posts_before_date(row.subreddit, date, row.username) for row in df[missing].itertuples()]
+
+        df['stock worth'] = (df['amount'] * df['posts'].astype(int) * df['value']).round().astype(int)
+        df['current rate'] = df['stock worth'] - df['amount']
+        return df.sort_values(['username', 'subreddit']).reset_index(drop=True)
+
+    def get_virtual_worths(self, date, valuations=None):
+        if valuations is None:
+            valuations = self.get_stock_valuations(date)
+
+        df = pd.read_sql_query("SELECT username, gems FROM balances", self.conn())
+        stock_worth = valuations.groupby('username')['stock worth'].sum()
+        df['virtual worth'] = df['gems'] + df['username'].map(stock_worth).fillna(0).astype(int)
+        return df[['username', 'virtual worth']]
     
     def create_gem_table(self):
+        self.render_image(self.prepare_gem_table())
+
+    def prepare_gem_table(self):
         print("Creating gem table.")
         
-        query = "SELECT username, gems, date FROM gems"
-        df = pd.read_sql_query(query, self.conn())
-
-        df['date'] = pd.to_datetime(df['date'])
-
-        latest_df = df.sort_values(['username', 'date']).groupby('username').last().reset_index()
-        latest_df = latest_df.drop('date',axis=1)
-
-        latest_df = latest_df.sort_values(by="gems", key=lambda s: s.str.lstrip('0').replace('', '0').map(lambda x: (len(x), x)), ascending = False)        
+        latest_df = pd.read_sql_query("SELECT username, gems FROM balances ORDER BY gems DESC", self.conn())
         df = pd.read_sql_query("SELECT username, amount FROM loans", self.conn())
 
-        n_columns = 2
         if len(df) > 0:
             latest_df["gems after interest"] = "-"
-            n_columns = 3
             for _, row in df.iterrows():
-                interest = round(float(row['amount'])*0.05)
+                interest = round(row['amount']*0.05)
                 gems = self.current_gems(row['username'])
-                latest_df.loc[latest_df["username"] == row['username'], "gems after interest"] = str(round(gems-interest))
+                latest_df.loc[latest_df["username"] == row['username'], "gems after interest"] = f"{round(gems-interest):,}"
 
-        # Format gems columns with comma
-        if 'gems' in latest_df.columns:
-            latest_df['gems'] = latest_df['gems'].apply(lambda s: ','.join([s[max(i - 3, 0):i] for i in range(len(s), 0, -3)][::-1]))
-        if 'gems after interest' in latest_df.columns:
-            latest_df['gems after interest'] = latest_df['gems after interest'].apply(lambda s: ','.join([s[max(i - 3, 0):i] for i in range(len(s), 0, -3)][::-1]))
+        # Format gems column with comma
+        latest_df['gems'] = latest_df['gems'].apply(lambda gems: f"{gems:,}")
 
-        # Calculate column widths dynamically
-        col_widths = []
-        for col in df.columns:
-            max_len = max([len(str(val)) for val in df[col]] + [len(str(col))])
-            col_widths.append(max_len * 0.13)  # 0.13 is an empirical scaling factor for width
-
-        # Create table image with dynamic width
-        total_width = sum(col_widths)
-        fig_width = max(5, total_width)  # Minimum width 5 inches        fig.patch.set_facecolor('white')  # Ensure full white background
-        fig, ax = plt.subplots(figsize=(fig_width, 3))  # Height is fixed, width is dynamic
-        ax.set_facecolor('white')  # Set axis background to white
-        ax.set_title("Gems", fontsize=14, fontweight="bold", pad=15)  # **Title**
-        ax.axis('tight')
-        ax.axis('off')
-        table = ax.table(cellText=latest_df.values, colLabels=latest_df.columns, cellLoc='center', loc='center')
-        
-        # Set column widths
-        for i, width in enumerate(col_widths):
-            table.auto_set_column_width(i)
-            for j in range(len(df) + 1):  # +1 for header
-                table[j, i].set_width(width)
-
-        # Format the Table
-        table.auto_set_font_size(False)
-        table.set_fontsize(8)
-        for j in range(len(df.columns)):
-            table[0, j].set_text_props(fontweight="bold")
-
-        # Save image
-        plt.savefig("gems.png", dpi=300, bbox_inches="tight")
-        
-        plt.clf()
-        plt.close('all')
+        return RenderJob(rendering.render_table_image, "gems.png", latest_df, dict(title="Gems", fig_height=3, dpi=300))
 
-    def create_stock_table(self, test = False):
-        print("Creating stock table.")
+    def create_stock_table(self, test = False, valuations = None):
+        self.render_image(self.prepare_stock_table(test, valuations))
 
-        query = "SELECT username, subreddit, amount, value FROM stocks"
-        df = pd.read_sql_query(query, self.conn())
+    def prepare_stock_table(self, test = False, valuations = None):
+        print("Creating stock table.")
 
-        df = df.sort_values(['username', 'subreddit'])
+        if valuations is None:
+            valuations = self.get_stock_valuations(self.get_today())
+        df = valuations[['username', 'subreddit', 'amount', 'value']].copy()
 
         if test:
             df['current rate'] = str(5)
-        else:        
-            j = [0]
-            df['current rate'] = [[print(f"row {j[0]+1} out of {len(df)}."), self.increase_counter(j), self.get_current_rate(row['username'], row['subreddit'], int(row['amount']), row['value'])][2]
-                for i, row in df.iterrows()]
+        else:
+            df['current rate'] = valuations['current rate'].apply(lambda rate: "+" + str(rate) if rate > 0 else str(rate))
 
         df['value'] = df['value'].round(5)
         df = df.rename(columns = {'value':'gems/post/stock'})
@@ -809,40 +2029,14 @@ class DailyTradeBot(metaclass=AutoPostCallMeta):
             elif df[col].dtype == float or df[col].dtype == int:
                 df[col] = df[col].apply(lambda x: f"{x:.5f}" if isinstance(x, float) else str(x))
 
-        # Calculate column widths dynamically
-        col_widths = []
-        for col in df.columns:
-            max_len = max([len(str(val)) for val in df[col]] + [len(str(col))])
-            col_widths.append(max_len * 0.13)  # 0.13 is an empirical scaling factor for width
-
-        # Create table image with dynamic width
-        total_width = sum(col_widths)
-        fig_width = max(5, total_width)  # Minimum width 5 inches
-        fig, ax = plt.subplots(figsize=(fig_width, 6))  # Height is fixed, width is dynamic
-        fig.patch.set_facecolor('white')
-        ax.set_facecolor('white')
-        ax.set_title("Stocks", fontsize=14, fontweight="bold", pad=15)  # **Title**
-        ax.axis('tight')
-        ax.axis('off')    
-        table = ax.table(cellText=df.values, colLabels=df.columns, cellLoc='center', loc='center')
-
-        # Set column widths
-        for i, width in enumerate(col_widths):
-            table.auto_set_column_width(i)
-            for j in range(len(df) + 1):  # +1 for header
-                table[j, i].set_width(width)
-
-        # Format the Table
-        table.auto_set_font_size(False)
-        table.set_fontsize(8)
-        for j in range(len(df.columns)):
-            table[0, j].set_text_props(fontweight="bold")
-
-        plt.savefig("stocks.png", dpi=200, bbox_inches="tight")
-        plt.clf()
-        plt.close('all')
+        return RenderJob(rendering.render_table_image, "stocks.png", df, dict(title="Stocks", fig_height=6, dpi=200))
 
     def create_loan_table(self):
+        job = self.prepare_loan_table()
+        if job is not None:
+            self.render_image(job)
+
+    def prepare_loan_table(self):
         print("Creating loan table.")
 
         df = pd.read_sql_query("SELECT username, amount FROM loans", self.conn())
@@ -850,163 +2044,109 @@ class DailyTradeBot(metaclass=AutoPostCallMeta):
         if len(df) == 0:
             return
         
-        # Create table image
-        fig, ax = plt.subplots(figsize=(5, 2))  # Adjust size as needed
-        fig.patch.set_facecolor('white')  # Ensure full white background
-        ax.set_facecolor('white')  # Set axis background to white
-        ax.set_title("Loans", fontsize=14, fontweight="bold", pad=15)  # **Title**
-        ax.axis('tight')
-        ax.axis('off')
-        table = ax.table(cellText=df.values, colLabels=df.columns, cellLoc='center', loc='center')
-        
-        # **Format the Table**
-        table.auto_set_font_size(False)
-        table.set_fontsize(8)
-        
-        # Make the first row bold
-        for j in range(2):  # 2 columns
-            table[0, j].set_text_props(fontweight="bold")
+        return RenderJob(rendering.render_table_image, "loans.png", df, dict(title="Loans", fig_height=2, dpi=300, scale_columns=False))
 
-        # Save image
-        plt.savefig("loans.png", dpi=300, bbox_inches="tight")
-        
-        plt.clf()
-        plt.close('all')
+    def create_virtual_worth_table(self, valuations = None):
+        self.render_image(self.prepare_virtual_worth_table(valuations))
 
-    def create_virtual_worth_table(self):
+    def prepare_virtual_worth_table(self, valuations = None):
         print("Creating virtual worth table.")
 
-        df = pd.read_sql_query("SELECT DISTINCT username FROM gems", self.conn())
-
-        df['virtual worth'] = df['username'].apply(lambda user: self.get_virtual_worth(user, self.get_today()))
+        df = self.get_virtual_worths(self.get_today(), valuations)
         df = df.sort_values(['virtual worth', 'username'], ascending = False)
         
         # Format virtual worth with comma
         if 'virtual worth' in df.columns:
             df['virtual worth'] = df['virtual worth'].apply(lambda x: f"{int(x):,}" if pd.notnull(x) else '')
 
-        # Calculate column widths dynamically
-        col_widths = []
-        for col in df.columns:
-            max_len = max([len(str(val)) for val in df[col]] + [len(str(col))])
-            col_widths.append(max_len * 0.13)  # 0.13 is an empirical scaling factor for width
-
-        # Create table image with dynamic width
-        total_width = sum(col_widths)
-        fig_width = max(5, total_width)  # Minimum width 5 inches        fig.patch.set_facecolor('white')  # Ensure full white background
-        fig, ax = plt.subplots(figsize=(fig_width, 3))  # Height is fixed, width is dynamic
-        ax.set_facecolor('white')  # Set axis background to white
-        ax.set_title("Virtual worth (gems + current stock value)", fontsize=14, fontweight="bold", pad=15)  # **Title**
-        ax.axis('tight')
-        ax.axis('off')
-        table = ax.table(cellText=df.values, colLabels=df.columns, cellLoc='center', loc='center')
-        
-        # Set column widths
-        for i, width in enumerate(col_widths):
-            table.auto_set_column_width(i)
-            for j in range(len(df) + 1):  # +1 for header
-                table[j, i].set_width(width)
-
-        # Format the Table
-        table.auto_set_font_size(False)
-        table.set_fontsize(8)
-        for j in range(len(df.columns)):
-            table[0, j].set_text_props(fontweight="bold")
-
-        # Save image
-        plt.savefig("virtual worth.png", dpi=300, bbox_inches="tight")
-        
-        plt.clf()
-        plt.close('all')
+        return RenderJob(rendering.render_table_image, "virtual worth.png", df, dict(title="Virtual worth (gems + current stock value)", fig_height=3, dpi=300))
+
+    def create_trend_image(self, sparkline_renderer = "pil"):
+        self.render_image(self.prepare_trend_image(sparkline_renderer))
 
-    def create_trend_image(self):
+    def prepare_trend_image(self, sparkline_renderer = "pil"):
         print("Creating subreddit trend image.")            
 
         # Fetch data
         query = """
-        SELECT subreddit, date, posts
-        FROM posts_per_subreddit
-        ORDER BY LOWER(subreddit), date;
+        SELECT p.subreddit, p.date, p.posts
+        FROM posts_per_subreddit p
+        JOIN allowed_subreddits a ON a.subreddit = p.subreddit
+        ORDER BY p.subreddit, p.date;
         """
         df = pd.read_sql(query, self.conn())
 
         # Process data
         df['date'] = pd.to_datetime(df['date'])
         latest_data = df[df['date'] == df['date'].max()].set_index('subreddit')
+        history = {subreddit: subset for subreddit, subset in df.groupby('subreddit', sort=False)}
 
-        # Define font size
-        title_font_size = 50  # Larger font for title
-        font_size = 24  # Larger text for content
-        title_font = ImageFont.truetype("arial.ttf", title_font_size)
-        font = ImageFont.truetype("arial.ttf", font_size)  # Change if needed
-        
         summary = []
         for i, subreddit in enumerate(latest_data.index):
             if (i+1)%25 == 0:
                 print(f"Working on subreddit {i+1} of {len(latest_data.index)}")
-            subset = df[df['subreddit'] == subreddit].sort_values('date')[-7:]
+            subset = history[subreddit][-7:]
 
             count_today = subset.iloc[-1]['posts']
             count_yesterday = subset.iloc[-2]['posts'] if len(subset) > 1 else 0
             change = count_today - count_yesterday
 
-            # Dynamic Y-limits for better scaling
-            min_y, max_y = subset['posts'].min(), subset['posts'].max()
-            buffer = (max_y - min_y) * 0.1  # Add a 10% buffer
-            min_y -= buffer
-            max_y += buffer
-
-            # Create mini trend plot with smaller size
-            fig_width, fig_height = 1.2, 0.6  # Maintain aspect ratio but smaller
-            fig, ax = plt.subplots(figsize=(fig_width, fig_height))
-            ax.plot(subset['date'], subset['posts'], color='blue', marker='o', markersize=3, linewidth=1)
-            ax.set_ylim(min_y, max_y)  # Prevent cutoff
-            ax.set_xticks([])  # Remove ticks for clarity
-            ax.set_yticks([])
-            ax.spines['top'].set_visible(False)
-            ax.spines['right'].set_visible(False)
-            ax.spines['left'].set_linewidth(0.5)
-            ax.spines['bottom'].set_linewidth(0.5)
-            plt.tight_layout()
-
-            # Save plot as image without resizing
-            buf = io.BytesIO()
-            plt.savefig(buf, format='PNG', dpi=100, bbox_inches='tight', pad_inches=0.1)
-            plt.close(fig)
-            buf.seek(0)
-            trend_img = Image.open(buf)
-
-            summary.append((subreddit, count_today, change, trend_img))
-
-        # Create final image with 3 columns
-        cols = 3
-        row_height = 50
-        col_width = 450
-        img_width = cols * col_width + 20
-        img_height = ((len(summary) + cols - 1) // cols) * row_height + 90
-        final_img = Image.new("RGB", (img_width, img_height), "white")
-        draw = ImageDraw.Draw(final_img)
-
-        # Add title
-        title_text = "Allowed Subreddits (and post trends)"
-        title_bbox = draw.textbbox((0, 0), title_text, font=title_font)
-        title_width = title_bbox[2] - title_bbox[0]
-        draw.text(((img_width - title_width) // 2, 10), title_text, fill="black", font=title_font)
-        
-        # Populate the image
-        x_offsets = [i * col_width for i in range(cols)]
-        y_offset = 90
-        for index, (subreddit, count, change, trend_img) in enumerate(summary):
-            col = index % cols
-            row = index // cols
-            x_offset = x_offsets[col] + 10
-            y_pos = y_offset + row * row_height
-            color = "black" if change == 0 else "green" if change > 0 else "red"
-            draw.text((x_offset, y_pos), f"{subreddit}: {count} ({'+' if change >= 0 else ''}{change})", fill=color, font=font)
-            final_img.paste(trend_img, (x_offset + 340, y_pos))  # Adjust position without resizing
-
-        # Save or display
-        final_img.save("subreddit summary.png")   
+            summary.append((subreddit, count_today, change, list(subset['date']), list(subset['posts'])))
+
+        return RenderJob(rendering.render_trend_image, "subreddit summary.png", summary, dict(sparkline_renderer=sparkline_renderer))
+
+    def fetch_cached_image(self, job):
+        key = self.render_cache.key(job.render_function.__name__, job.data, job.params)
+        found = self.render_cache.fetch(key, job.filename)
+        if found:
+            print(f"Nothing changed, reused {job.filename}.")
+        return key, found
+
+    def render_image(self, job):
+        key, found = self.fetch_cached_image(job)
+        if found:
+            return 0
+        elapsed = timed_render(job)
+        self.render_cache.store(key, job.filename)
+        return elapsed
+
+    def create_images(self, valuations = None):
+        if valuations is None:
+            valuations = self.get_stock_valuations(self.get_today())
+
+        # All data is read from the database first, after that the images are rendered in parallel
+        jobs = [self.prepare_gem_table(), self.prepare_stock_table(valuations=valuations), self.prepare_loan_table(),
+                self.prepare_virtual_worth_table(valuations), self.prepare_trend_image()]
+        jobs = [job for job in jobs if job is not None]
+
+        self.render_timings = {}
+        pending = []
+        for job in jobs:
+            key, found = self.fetch_cached_image(job)
+            if found:
+                self.render_timings[job.filename] = 0
+            else:
+                pending.append((key, job))
+
+        if len(pending) > 1 and self.render_workers > 1:
+            with ProcessPoolExecutor(max_workers=min(len(pending), self.render_workers), initializer=rendering.use_agg_backend) as executor:
+                futures = {executor.submit(timed_render, job): (key, job) for key, job in pending}
+                for future in as_completed(futures):
+                    key, job = futures[future]
+                    self.render_timings[job.filename] = future.result()
+                    self.render_cache.store(key, job.filename)
+        else:
+            for key, job in pending:
+                self.render_timings[job.filename] = timed_render(job)
+                self.render_cache.store(key, job.filename)
+
+        for _, job in pending:
+            print(f"Rendered {job.filename} in {self.render_timings[job.filename]:.2f} seconds")
+        for job in jobs:
+            self.profiler.time('render', job.filename, self.render_timings[job.filename])
+        self.profiler.count('render_cache', 'hits', len(jobs) - len(pending))
+        self.profiler.count('render_cache', 'misses', len(pending))
+        return self.render_timings
 
     def display_table(self,table_name,order_by=None):        
         self.cursor().execute("SELECT name FROM sqlite_master WHERE type='table'")
@@ -1023,7 +2163,7 @@ class DailyTradeBot(metaclass=AutoPostCallMeta):
             for row in rows:
                 print(row)
             print("-" * 40)
-        self.conn().close()
+        self.close_connection()
 
     def display_all_tables(self):
         self.cursor().execute("SELECT name FROM sqlite_master WHERE type='table'")
@@ -1035,10 +2175,11 @@ class DailyTradeBot(metaclass=AutoPostCallMeta):
             for row in rows:
                 print(row)
             print("-" * 40)
-        self.conn().close()
+        self.close_connection()
 
-    def check_sub(self):
-        subreddit_name = input('Subreddit name: ')
+    def check_sub(self, subreddit_name=None):
+        if subreddit_name is None:
+            subreddit_name = input('Subreddit name: ')
         print(f"Getting post numbers of the r/{subreddit_name} subreddit from the past few days.")
 
         for i in range(6):
@@ -1046,86 +2187,72 @@ class DailyTradeBot(metaclass=AutoPostCallMeta):
             date_text = f"{handle_date.year}-{handle_date.month}-{handle_date.day}"
             print(f"{date_text}: {str(self.get_posts_before_date(subreddit_name, date_text))}")
 
-    def split_change_log(self, text, max_length=9600):
+    def split_change_log(self, chunks):
         parts = []
-        part_number = 1
-
-        while len(text) > max_length:
-            split_index = text.rfind('\n', 0, max_length)
-            if split_index == -1:  # If no newline is found, force split
-                split_index = max_length
-            
-            part_text = text[:split_index]
+        for part_number, part_text in enumerate(chunks, start=1):
+            end_text = "This will summon Aart, my creator.)"
+            if part_number == len(chunks):
+                end_text = "This will summon Aart, my creator. The code for this bot is fully open source, and can be found [here](https://github.com/AartvB/DailyTrade).)"
             formatted_text = (
                 f"*These are the actions I performed since last post (part {part_number}).*\n\n"
                 "---\n"
                 f"{part_text}\n\n"
                 "---\n"
                 "^(These actions were performed automatically by a bot. If you think I made a mistake, respond to this comment. "
-                "This will summon Aart, my creator.)"
+                f"{end_text}"
             )
             parts.append(formatted_text)
-            text = text[split_index+1:]  # Skip the newline character
-            part_number += 1
-
-        # Add the last remaining part
-        formatted_text = (
-            f"*These are the actions I performed since last post (part {part_number}).*\n\n"
-            "---\n"
-            f"{text}\n\n"
-            "---\n"
-            "^(These actions were performed automatically by a bot. If you think I made a mistake, respond to this comment. "
-            "This will summon Aart, my creator. The code for this bot is fully open source, and can be found [here](https://github.com/AartvB/DailyTrade).)"
-        )
-        parts.append(formatted_text)
 
         return parts
     
     def run_bot(self):        
-        self.backup_database()
+        self.profiler.reset()
+        with self.profiler.phase('setup'):
+            self.backup_database()
+            self.setup_database()
+            self.clear_run_caches()
 
-        post_id, post_date = self.get_latest_post()
+            post_id, post_date = self.get_latest_post()
         
-        if (datetime.strptime(self.get_today(), "%Y-%m-%d") - datetime.strptime(post_date, "%Y-%m-%d")).days <= 2:
-            self.get_posts_per_subreddit(post_date)
-        self.get_posts_per_subreddit(self.get_today())
-
-        submission = self.reddit.submission(id=post_id)
-        submission.comments.replace_more(limit=None)  # Load all nested comments
-
-        df = pd.DataFrame(columns=["username", "message"])
-        df = pd.concat([df, self.pay_interest(self.get_today())], ignore_index=True)
-            
-        comments_to_ignore = pd.read_sql_query("SELECT comment_id, date FROM comments", self.conn())
-        
-        for comment in submission.comments.list():
-            ignore_comment = False
-            for _, row in comments_to_ignore.iterrows():
-                if comment.id == row['comment_id'] and post_date == row['date']:
-                    ignore_comment = True
-                    break
-            if ignore_comment:
-                continue
+        with self.profiler.phase('crawl'):
+            if (datetime.strptime(self.get_today(), "%Y-%m-%d") - datetime.strptime(post_date, "%Y-%m-%d")).days <= 2:
+                self.get_posts_per_subreddit(post_date)
+                self.get_user_posts_per_subreddit(post_date)
+            self.get_posts_per_subreddit(self.get_today())
+
+        with self.profiler.phase('load comments'):
+            self.ingest_comments(post_id)
+
+        with self.profiler.phase('commands'):
+            # Every step is committed together with its messages, so a crashed run continues where it stopped
+            with self.unit_of_work():
+                if not self.step_is_completed('interest', self.get_today()):
+                    self.record_messages(self.pay_interest(self.get_today()))
+                    self.complete_step('interest', self.get_today())
+
+            processed_comments = self.processed_comment_ids(post_date)
+
+            comments = [(comment_id, author, body) for comment_id, author, body in self.staged_comments(post_id) if comment_id not in processed_comments and author is not None]
+            if self.execution_workers > 1:
+                self.execute_comments_in_parallel(comments, post_date)
+            else:
+                self.execute_comments(comments, post_date)
 
-            print("Working on comment by " + comment.author.name + ":\n" + comment.body)
+            change_log = self.get_change_log(self.get_today())
 
-            df = pd.concat([df, self.execute_commands(comment.author.name,self.extract_commands(comment.body))], ignore_index=True)
-            print("\n")
+            self.snapshot_ledger_if_needed()
 
-        df.sort_values(by=['username'])
-        
-        self.create_gem_table()
-        self.create_stock_table()
-        self.create_loan_table()
-        self.create_virtual_worth_table()
-        self.create_trend_image()
+        with self.profiler.phase('images'):
+            self.create_images()
 
-        change_log = self.format_messages(df)
-        
         print('\n\n\n\n\n\n\n CHANGELOG')
         print(change_log)
         print("Finished applying commands!")
 
+        profile_path = self.profiler.write()
+        print(self.profiler.summary())
+        print(f"Profile written to {profile_path}")
+
         return change_log
     
     def publish_post(self, change_log):
@@ -1196,15 +2323,18 @@ Let me know if you have any questions. Happy trading!\n\n
         flair_id=flair_template_id)
 
         print(f"Post created: {post.url} - {post.id}")
+        # Stored right away, so a run that fails after this point is not published a second time
+        self.cursor().execute("INSERT INTO posts (post_id, date) VALUES (?, ?)", (post.id, self.get_today()))
+        self.commit()
 
         submission = self.reddit.submission(id=post.id)
         explanation = submission.reply(explanation_text)
         print(f"Explanation posted: {explanation.id}")
 
-        self.cursor().execute("INSERT INTO posts (post_id, date) VALUES (?, ?)", (post.id, self.get_today()))
         self.cursor().execute("INSERT INTO comments (comment_id, date) VALUES (?, ?)", (explanation.id, self.get_today()))
-        self.conn().commit()
-        if len(change_log) == 0:
+        self.commit()
+        chunks = list(change_log.chunks(9600))
+        if len(chunks) == 0:
             change_log = (
                 f"*These are the actions I performed since last post.*\n\n"
                 "---\n"
@@ -1215,23 +2345,23 @@ Let me know if you have any questions. Happy trading!\n\n
             log = submission.reply(change_log)
             print(f"Log posted: {log.id}")
             self.cursor().execute("INSERT INTO comments (comment_id, date) VALUES (?, ?)", (log.id, self.get_today()))
-            self.conn().commit()        
-        elif len(change_log) > 9600:
-            for log_part in self.split_change_log(change_log):
+            self.commit()        
+        elif len(chunks) > 1:
+            for log_part in self.split_change_log(chunks):
                 log = submission.reply(log_part)
                 print(f"Part of log posted: {log.id}")
                 self.cursor().execute("INSERT INTO comments (comment_id, date) VALUES (?, ?)", (log.id, self.get_today()))
-                self.conn().commit()
+                self.commit()
         else:
             change_log = (
                 f"*These are the actions I performed since last post.*\n\n"
                 "---\n"
-                f"{change_log}\n\n"
+                f"{chunks[0]}\n\n"
                 "---\n"
                 "^(These actions were performed automatically by a bot. If you think I made a mistake, respond to this comment. This will summon Aart, my creator. The code for this bot is fully open source, and can be found [here](https://github.com/AartvB/DailyTrade).)"
             )
             log = submission.reply(change_log)
             print(f"Log posted: {log.id}")
             self.cursor().execute("INSERT INTO comments (comment_id, date) VALUES (?, ?)", (log.id, self.get_today()))
-            self.conn().commit()
+            self.commit()
         print("Finished!")
\ No newline at end of file
@@ -0,0 +1,190 @@
+import random
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+# A local stand-in for the parts of praw.Reddit that DailyTradeBot uses, so the bot can run without Reddit credentials.
+# Pass it to DailyTradeBot(reddit=FakeReddit(...)).
+
+class FakeNetwork:
+    def __init__(self, latency=0.0):
+        self.latency = latency  # Seconds per request
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def request(self):
+        with self.lock:
+            self.requests += 1
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+class FakeSubmission:
+    def __init__(self, reddit, id, subreddit=None, created_utc=0, author=None, title="", comments=None):
+        self.reddit = reddit
+        self.id = id
+        self.subreddit = subreddit
+        self.created_utc = created_utc
+        self.author = author
+        self.title = title
+        self.url = f"https://www.reddit.com/comments/{id}"
+        self.comments = FakeCommentForest(comments or [])
+        self.flair = FakeFlair()
+
+    def reply(self, body):
+        comment = self.reddit.new_comment(self.reddit.user, body)
+        self.comments.comments.append(comment)
+        return comment
+
+class FakeComment:
+    def __init__(self, id, author, body, replies=None, created_utc=None):
+        self.id = id
+        self.author = author
+        self.body = body
+        self.created_utc = time.time() if created_utc is None else created_utc
+        self.replies = FakeCommentForest(replies or [])
+
+class FakeCommentForest:
+    def __init__(self, comments):
+        self.comments = comments
+
+    def replace_more(self, limit=None):
+        return []
+
+    def list(self):
+        # Breadth first, like praw
+        queue = list(self.comments)
+        result = []
+        while queue:
+            comment = queue.pop(0)
+            result.append(comment)
+            queue.extend(comment.replies.comments)
+        return result
+
+class FakeFlair:
+    def choices(self):
+        return [{'flair_template_id': 'serious', 'flair_text': '[Serious]'}]
+
+class FakeRedditor:
+    def __init__(self, reddit, name):
+        self.reddit = reddit
+        self.name = name
+        self.submissions = FakeListing(reddit, lambda: reddit.user_submissions.get(name, []))
+
+    def __str__(self):
+        return self.name
+
+class FakeListing:
+    def __init__(self, reddit, items):
+        self.reddit = reddit
+        self.items = items
+
+    def new(self, limit=100):
+        # Listings are fetched in pages of 100 items, each page is one request. Reddit never returns more than 1000 items.
+        limit = 1000 if limit is None else min(limit, 1000)
+        for i, item in enumerate(self.items()):
+            if i >= limit:
+                return
+            if i % 100 == 0:
+                self.reddit.network.request()
+            yield item
+
+class FakeStream:
+    def __init__(self, subreddit):
+        self.subreddit = subreddit
+
+    def submissions(self, pause_after=None, skip_existing=False):
+        # Replays the submissions of the past days of every subreddit in a+b+c, oldest first, 100 per request.
+        # After that nothing new arrives: with pause_after the stream yields None until the caller stops, without it the stream ends.
+        reddit = self.subreddit.reddit
+        since = time.time() - reddit.stream_days * 86400
+        submissions = []
+        if not skip_existing:
+            for name in self.subreddit.display_name.split("+"):
+                for submission in reddit.subreddit_submissions(name):
+                    if submission.created_utc < since:
+                        break
+                    submissions.append(submission)
+        submissions.sort(key=lambda submission: submission.created_utc)
+        for i, submission in enumerate(submissions):
+            if i % 100 == 0:
+                reddit.network.request()
+            yield submission
+        while pause_after is not None:
+            reddit.network.request()
+            yield None
+
+class FakeSubreddit:
+    def __init__(self, reddit, name):
+        self.reddit = reddit
+        self.display_name = name
+        self.stream = FakeStream(self)
+
+    def __str__(self):
+        return self.display_name
+
+    def new(self, limit=100):
+        return FakeListing(self.reddit, lambda: self.reddit.subreddit_submissions(self.display_name)).new(limit)
+
+    def moderator(self):
+        self.reddit.network.request()
+        return [FakeRedditor(self.reddit, name) for name in self.reddit.moderators]
+
+    def submit_gallery(self, title, images, flair_id=None):
+        self.reddit.network.request()
+        return self.reddit.new_submission(self.display_name, title)
+
+class FakeReddit:
+    def __init__(self, posts_per_day=None, default_posts_per_day=50, latency=0.0, seed=0, moderators=("DailyTradeBot",)):
+        self.posts_per_day = {name.lower(): posts for name, posts in (posts_per_day or {}).items()}
+        self.default_posts_per_day = default_posts_per_day
+        self.network = FakeNetwork(latency)
+        self.seed = seed
+        self.moderators = list(moderators)
+        self.stream_days = 2
+        self.validate_on_submit = False
+        self.user = FakeRedditor(self, "DailyTradeBot")
+        self.user_submissions = {}
+        self.submissions = {}
+        self.next_id = 0
+        self.lock = threading.Lock()
+
+    def new_id(self):
+        with self.lock:
+            self.next_id += 1
+            return f"fake{self.next_id}"
+
+    def new_submission(self, subreddit, title="", comments=None):
+        submission = FakeSubmission(self, self.new_id(), subreddit, time.time(), self.user, title, comments)
+        self.submissions[submission.id] = submission
+        return submission
+
+    def new_comment(self, author, body, replies=None):
+        if isinstance(author, str):
+            author = FakeRedditor(self, author)
+        return FakeComment(self.new_id(), author, body, replies)
+
+    def add_user_submission(self, username, subreddit, created_utc):
+        self.user_submissions.setdefault(username, []).append(FakeSubmission(self, self.new_id(), subreddit, created_utc, username))
+        self.user_submissions[username].sort(key=lambda submission: submission.created_utc, reverse=True)
+
+    def subreddit_submissions(self, name):
+        # Evenly spread posts over the past days, newest first, the same for every run with the same seed
+        rng = random.Random(f"{self.seed} {name.lower()}")
+        posts_per_day = self.posts_per_day.get(name.lower(), self.default_posts_per_day)
+        if posts_per_day <= 0:
+            return
+        interval = 86400 / posts_per_day
+        created_utc = datetime.combine(date.today() + timedelta(days=1), datetime.min.time()).timestamp()
+        while True:
+            created_utc -= interval * rng.uniform(0.5, 1.5)
+            yield FakeSubmission(self, f"{name}_{int(created_utc)}", name, created_utc, f"poster{int(created_utc) % 1000}")
+
+    def subreddit(self, name):
+        return FakeSubreddit(self, name)
+
+    def redditor(self, name):
+        return FakeRedditor(self, name)
+
+    def submission(self, id):
+        self.network.request()
+        return self.submissions[id]
@@ -0,0 +1,9 @@
+from dailytradebot import DailyTradeBot
+
+if __name__ == "__main__":
+    with DailyTradeBot() as bot:
+        # Runs until it is interrupted, the daily run uses the stream for every time window that it covered completely
+        try:
+            bot.ingest_submissions()
+        except KeyboardInterrupt:
+            print("Stopped following the submission stream")
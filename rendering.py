@@ -0,0 +1,142 @@
+import io
+import os
+import matplotlib
+import matplotlib.pyplot as plt
+from PIL import Image, ImageDraw, ImageFont
+
+# The image builders of the daily report. dailytradebot.py imports this module on first use, so commands that do not render images start quickly.
+
+def render_sparkline_matplotlib(dates, posts):
+    # Dynamic Y-limits for better scaling
+    min_y, max_y = min(posts), max(posts)
+    buffer = (max_y - min_y) * 0.1  # Add a 10% buffer
+    min_y -= buffer
+    max_y += buffer
+
+    # Create mini trend plot with smaller size
+    fig_width, fig_height = 1.2, 0.6  # Maintain aspect ratio but smaller
+    fig, ax = plt.subplots(figsize=(fig_width, fig_height))
+    ax.plot(dates, posts, color='blue', marker='o', markersize=3, linewidth=1)
+    ax.set_ylim(min_y, max_y)  # Prevent cutoff
+    ax.set_xticks([])  # Remove ticks for clarity
+    ax.set_yticks([])
+    ax.spines['top'].set_visible(False)
+    ax.spines['right'].set_visible(False)
+    ax.spines['left'].set_linewidth(0.5)
+    ax.spines['bottom'].set_linewidth(0.5)
+    plt.tight_layout()
+
+    # Save plot as image without resizing
+    buf = io.BytesIO()
+    plt.savefig(buf, format='PNG', dpi=100, bbox_inches='tight', pad_inches=0.1)
+    plt.close(fig)
+    buf.seek(0)
+    return Image.open(buf)
+
+def draw_sparkline(draw, position, dates, posts, width=90, height=30, padding=10):
+    # Draws the same mini trend plot as render_sparkline_matplotlib, directly on the final image
+    left, top = position[0] + padding, position[1] + padding
+    right, bottom = left + width, top + height
+
+    days = [(day - dates[0]).days for day in dates]
+    x_margin = (days[-1] - days[0]) * 0.05  # Matplotlib adds a 5% margin to the data range
+    min_x, max_x = days[0] - x_margin, days[-1] + x_margin
+    min_y, max_y = min(posts), max(posts)
+    buffer = (max_y - min_y) * 0.1  # Add a 10% buffer
+    min_y -= buffer
+    max_y += buffer
+
+    points = []
+    for day, n_posts in zip(days, posts):
+        x = left + (day - min_x) / (max_x - min_x) * width if max_x > min_x else (left + right) / 2
+        y = bottom - (n_posts - min_y) / (max_y - min_y) * height if max_y > min_y else (top + bottom) / 2
+        points.append((x, y))
+
+    draw.line([(left, top), (left, bottom), (right, bottom)], fill=(80, 80, 80), width=1)  # Thin spines look grey
+    if len(points) > 1:
+        draw.line(points, fill="blue", width=2, joint="curve")
+    for x, y in points:
+        draw.ellipse([x - 2, y - 2, x + 2, y + 2], fill="blue")
+
+def render_table_image(df, filename, title, fig_height, dpi, scale_columns=True):
+    # Calculate column widths dynamically
+    col_widths = []
+    if scale_columns:
+        for col in df.columns:
+            max_len = max([len(str(val)) for val in df[col]] + [len(str(col))])
+            col_widths.append(max_len * 0.13)  # 0.13 is an empirical scaling factor for width
+
+    # Create table image with dynamic width
+    total_width = sum(col_widths)
+    fig_width = max(5, total_width)  # Minimum width 5 inches
+    fig, ax = plt.subplots(figsize=(fig_width, fig_height))  # Height is fixed, width is dynamic
+    fig.patch.set_facecolor('white')  # Ensure full white background
+    ax.set_facecolor('white')  # Set axis background to white
+    ax.set_title(title, fontsize=14, fontweight="bold", pad=15)  # **Title**
+    ax.axis('tight')
+    ax.axis('off')
+    table = ax.table(cellText=df.values, colLabels=df.columns, cellLoc='center', loc='center')
+
+    # Set column widths
+    for i, width in enumerate(col_widths):
+        table.auto_set_column_width(i)
+        for j in range(len(df) + 1):  # +1 for header
+            table[j, i].set_width(width)
+
+    # Format the Table
+    table.auto_set_font_size(False)
+    table.set_fontsize(8)
+    for j in range(len(df.columns)):
+        table[0, j].set_text_props(fontweight="bold")
+
+    # Save image
+    plt.savefig(filename, dpi=dpi, bbox_inches="tight")
+
+    plt.clf()
+    plt.close('all')
+
+FONT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "arial.ttf")
+
+def render_trend_image(summary, filename, sparkline_renderer="pil"):
+    # Define font size
+    title_font_size = 50  # Larger font for title
+    font_size = 24  # Larger text for content
+    title_font = ImageFont.truetype(FONT_PATH, title_font_size)
+    font = ImageFont.truetype(FONT_PATH, font_size)  # Change if needed
+
+    # Create final image with 3 columns
+    cols = 3
+    row_height = 50
+    col_width = 450
+    img_width = cols * col_width + 20
+    img_height = ((len(summary) + cols - 1) // cols) * row_height + 90
+    final_img = Image.new("RGB", (img_width, img_height), "white")
+    draw = ImageDraw.Draw(final_img)
+
+    # Add title
+    title_text = "Allowed Subreddits (and post trends)"
+    title_bbox = draw.textbbox((0, 0), title_text, font=title_font)
+    title_width = title_bbox[2] - title_bbox[0]
+    draw.text(((img_width - title_width) // 2, 10), title_text, fill="black", font=title_font)
+    
+    # Populate the image
+    x_offsets = [i * col_width for i in range(cols)]
+    y_offset = 90
+    for index, (subreddit, count, change, dates, posts) in enumerate(summary):
+        col = index % cols
+        row = index // cols
+        x_offset = x_offsets[col] + 10
+        y_pos = y_offset + row * row_height
+        color = "black" if change == 0 else "green" if change > 0 else "red"
+        draw.text((x_offset, y_pos), f"{subreddit}: {count} ({'+' if change >= 0 else ''}{change})", fill=color, font=font)
+        if sparkline_renderer == "matplotlib":
+            final_img.paste(render_sparkline_matplotlib(dates, posts), (x_offset + 340, y_pos))  # Adjust position without resizing
+        else:
+            draw_sparkline(draw, (x_offset + 340, y_pos), dates, posts)
+
+    # Save or display
+    final_img.save(filename)
+
+def use_agg_backend():
+    # Worker processes only write image files, so they never need an interactive backend
+    matplotlib.use('Agg')
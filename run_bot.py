@@ -1,5 +1,6 @@
 from dailytradebot import DailyTradeBot
 
-bot = DailyTradeBot()
-change_log = bot.run_bot(keep_open=True)
-bot.publish_post(change_log)
\ No newline at end of file
+if __name__ == "__main__":
+    with DailyTradeBot() as bot:
+        change_log = bot.run_bot()
+        bot.publish_post(change_log)
\ No newline at end of file
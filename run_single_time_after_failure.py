@@ -1,6 +1,11 @@
 from dailytradebot import DailyTradeBot
 
-bot = DailyTradeBot()
-bot.restore_latest_backup()
-change_log = bot.run_bot(keep_open=False)
-bot.publish_post(change_log)
\ No newline at end of file
+if __name__ == "__main__":
+    with DailyTradeBot() as bot:
+        # Undo changes to gems, stocks and loans that did not go through the ledger, then continue the interrupted run.
+        # Processed comments, change log messages and ledger events are committed together, and post counts are only stored once complete,
+        # so the other tables never hold part of a step. Restore a backup instead (dailytrade.py restore) to redo the whole run.
+        bot.setup_database()
+        bot.rebuild_state_from_ledger()
+        change_log = bot.run_bot()
+        bot.publish_post(change_log)
@@ -1,15 +1,89 @@
-import subprocess
-import sys
-import schedule
 import time
+import traceback
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+from dailytradebot import DailyTradeBot
 
-#subprocess.run([sys.executable, "run_bot.py"], check=True)
+class DailyScheduler:
+    # Keeps one bot, with its imports, reddit session and database connection, between runs.
+    # The bot is started at the exact time of the daily run, and a run that was missed is started as soon as possible.
+    def __init__(self, bot, hour=7, minute=5, time_zone="Europe/Amsterdam", retries=3, retry_delay=15 * 60):
+        self.bot = bot
+        self.hour = hour
+        self.minute = minute
+        self.time_zone = ZoneInfo(time_zone)
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.given_up_date = None
 
-def run():
-    subprocess.run([sys.executable, "run_bot.py"], check=True)
+    def now(self):
+        return datetime.now(self.time_zone)
 
-schedule.every().day.at("07:05", "Europe/Amsterdam").do(run)
+    def run_time(self, day):
+        return datetime(day.year, day.month, day.day, self.hour, self.minute, tzinfo=self.time_zone)
 
-while True:
-    schedule.run_pending()
-    time.sleep(60*60*2) # Try again after 2 hours
\ No newline at end of file
+    def next_run_time(self, now):
+        run_time = self.run_time(now.date())
+        return run_time if run_time > now else self.run_time(now.date() + timedelta(days=1))
+
+    def run_is_due(self, now):
+        if now < self.run_time(now.date()) or self.given_up_date == now.date():
+            return False
+        return not self.bot.post_is_published()
+
+    def sleep_until(self, moment):
+        # Sleeps in steps, so a suspended machine or a changed clock does not delay the run
+        while True:
+            remaining = moment.timestamp() - time.time()
+            if remaining <= 0:
+                return
+            time.sleep(min(remaining, 10 * 60))
+
+    def run(self):
+        for attempt in range(self.retries + 1):
+            try:
+                if attempt > 0:
+                    # The post may have been published before the attempt failed, it must not be published twice
+                    if self.bot.post_is_published():
+                        print("Today's post has already been published")
+                        return True
+                    # Undo changes to the game state that did not go through the ledger, then continue the interrupted run
+                    self.bot.setup_database()
+                    self.bot.rebuild_state_from_ledger()
+                change_log = self.bot.run_bot()
+                self.bot.publish_post(change_log)
+                return True
+            except Exception:
+                traceback.print_exc()
+                # A failed run may leave a transaction open, the next attempt starts with a fresh connection
+                self.bot.close_connection()
+                if attempt < self.retries:
+                    print(f"Run failed, trying again in {self.retry_delay // 60} minutes ({attempt + 1} out of {self.retries} retries)")
+                    time.sleep(self.retry_delay)
+        print(f"Run failed {self.retries + 1} times, trying again at the next run time")
+        return False
+
+    def serve_forever(self):
+        while True:
+            now = self.now()
+            try:
+                due = self.run_is_due(now)
+            except Exception:
+                # E.g. a locked database, the scheduler keeps running and checks again later
+                traceback.print_exc()
+                self.bot.close_connection()
+                print(f"Could not check whether a run is due, trying again in {self.retry_delay // 60} minutes")
+                time.sleep(self.retry_delay)
+                continue
+            if due:
+                print(f"Starting the run of {now.date().isoformat()}")
+                if not self.run():
+                    self.given_up_date = now.date()
+                continue
+            next_run_time = self.next_run_time(now)
+            print(f"Next run at {next_run_time.isoformat(' ', 'minutes')}")
+            self.sleep_until(next_run_time)
+
+if __name__ == "__main__":
+    with DailyTradeBot() as bot:
+        DailyScheduler(bot).serve_forever()
@@ -0,0 +1,132 @@
+import sqlite3
+import threading
+from datetime import date, timedelta
+import pytest
+import dailytrade
+from benchmark import add_fake_game
+from dailytradebot import DailyTradeBot
+from fake_reddit import FakeReddit, FakeSubmission
+
+# Behaviour checks that the benchmarks in benchmark.py rely on, run with "python -m pytest".
+# The bot writes its database, backups and images to the working directory, so every test runs in its own directory.
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+def start_fake_game(n_players=30, execution_workers=1, seed=0):
+    reddit = FakeReddit(seed=seed)
+    bot = DailyTradeBot(reddit=reddit)
+    bot.crawl_requests_per_minute = 1000000  # The fake backend has no rate limit
+    bot.execution_workers = execution_workers
+    bot.render_workers = 1
+    bot.setup_database()
+    submission = add_fake_game(reddit, bot.allowed_subreddits(), n_players, 3, seed)
+    bot.cursor().execute("INSERT INTO posts (post_id, date) VALUES (?, ?)", (submission.id, (date.today() - timedelta(days=1)).isoformat()))
+    bot.commit()
+    return bot
+
+def test_connection_is_kept_per_thread(workdir):
+    # user-005: one long-lived connection for the main thread, and a separate one for each worker thread
+    with start_fake_game() as bot:
+        conn = bot.conn()
+        bot.get_latest_post()
+        bot.pay_interest(bot.get_today())
+        assert bot.conn() is conn
+        assert bot.connections.open_count == 1
+
+        worker_conn = []
+        worker = threading.Thread(target=lambda: worker_conn.append(bot.conn()))
+        worker.start()
+        worker.join()
+        assert worker_conn[0] is not conn
+        assert bot.connections.open_count == 2
+
+        # The connection of a finished worker is closed, the connection of the main thread stays open
+        bot.connections.close_finished_threads()
+        with pytest.raises(sqlite3.ProgrammingError):
+            worker_conn[0].execute("SELECT 1")
+        assert bot.conn() is conn
+    assert not bot.connection_is_open()
+
+def test_unchanged_images_are_reused(workdir):
+    # user-010: creating the images again over the same rows takes every image from the render cache
+    with start_fake_game() as bot:
+        bot.run_bot()
+        first_images = {filename: (workdir / filename).read_bytes() for filename in bot.render_timings}
+        assert first_images and all(elapsed > 0 for elapsed in bot.render_timings.values())
+
+        bot.create_images()
+        assert bot.render_timings == {filename: 0 for filename in first_images}
+        assert {filename: (workdir / filename).read_bytes() for filename in first_images} == first_images
+
+def run_fake_game(directory, monkeypatch, execution_workers):
+    directory.mkdir()
+    monkeypatch.chdir(directory)
+    with start_fake_game(n_players=100, execution_workers=execution_workers) as bot:
+        bot.create_images = lambda valuations=None: {}
+        change_log = bot.run_bot()
+        return str(change_log), bot.state_at()
+
+def test_parallel_execution_matches_serial(tmp_path, monkeypatch):
+    # user-020: executing the comments of different players in parallel gives the same change log and game state
+    serial_change_log, serial_state = run_fake_game(tmp_path / "serial", monkeypatch, execution_workers=1)
+    parallel_change_log, parallel_state = run_fake_game(tmp_path / "parallel", monkeypatch, execution_workers=4)
+    assert serial_change_log
+    assert serial_change_log == parallel_change_log
+    assert serial_state == parallel_state
+
+def test_comments_posted_after_ingest_are_loaded(workdir):
+    # user-019: a post whose comments were all loaded is topped up with the comments that were posted since
+    with start_fake_game() as bot:
+        post_id, _ = bot.get_latest_post()
+        bot.ingest_comments(post_id)
+        staged = bot.staged_comments(post_id)
+
+        submission = bot.reddit.submissions[post_id]
+        submission.comments.comments.append(bot.reddit.new_comment("latecomer", "[buy 10 r/memes]"))
+        bot.reddit.network.requests = 0
+        bot.ingest_comments(post_id)
+        assert bot.staged_comments(post_id) == staged + [(submission.comments.comments[-1].id, "latecomer", "[buy 10 r/memes]")]
+        assert bot.reddit.network.requests == 1
+
+def test_stream_restarts_after_a_session_without_submissions(workdir):
+    # user-023: a session in which nothing was posted has no newest submission, the restarted stream starts a new session
+    reddit = FakeReddit()
+    reddit.stream_days = -1  # Nothing was posted yet
+    with DailyTradeBot(reddit=reddit) as bot:
+        bot.stream_refresh_seconds = 0  # Every submission of the stream is followed by a refresh
+        stop = threading.Event()
+        stored = []
+        store = bot.store_streamed_submissions
+        def store_twice(session_id, rows, caught_up):
+            store(session_id, rows, caught_up)
+            stored.append((session_id, len(rows), caught_up))
+            reddit.stream_days = 2
+            if len(stored) == 2:
+                stop.set()
+        bot.store_streamed_submissions = store_twice
+        bot.ingest_submissions(stop)
+        assert stored == [(1, 0, True), (2, 1, False)]
+
+def test_post_is_recorded_before_the_replies(workdir, monkeypatch):
+    # user-024: a run that fails after the gallery was submitted must not publish it again
+    with start_fake_game() as bot:
+        change_log = bot.run_bot()
+        def fail(submission, body):
+            raise ConnectionError("reply failed")
+        monkeypatch.setattr(FakeSubmission, "reply", fail)
+        with pytest.raises(ConnectionError):
+            bot.publish_post(change_log)
+        _, post_date = bot.get_latest_post()
+        assert post_date == bot.get_today()
+
+def test_run_after_publishing_does_nothing(workdir, monkeypatch):
+    # user-025: running again on the day of the post neither executes the comments of the new post nor publishes again
+    with start_fake_game() as bot:
+        bot.publish_post(bot.run_bot())
+        monkeypatch.setattr(bot, "run_bot", lambda: pytest.fail("run_bot was called"))
+        monkeypatch.setattr(bot, "publish_post", lambda change_log: pytest.fail("publish_post was called"))
+        dailytrade.run(bot, dailytrade.parse_arguments(["run"]))
+        dailytrade.publish(bot, dailytrade.parse_arguments(["publish"]))